@@ -3,6 +3,7 @@
 #This is a library for helping with angles and 2D vectors
 
 import math
+import numpy
 import pygame.math
 import random
 
@@ -41,12 +42,11 @@ def facing(vector):
     return pygame.math.Vector2([round(i) for i in vector.normalize()]).normalize()
 
 def slerp(a, b, t=0):
-    if a == ZERO or b == ZERO:
-        return ZERO
+    """Spherically interpolate from vector a to vector b, rotating
+       through the angle between them while scaling between their
+       lengths."""
     
-    omega = np.arcsin(np.dot(a / np.linalg.norm(a), b / np.linalg.norm(b)))
-    so = np.sin(omega)
-    return pygame.math.Vector2(math.sin((1.0-t) * omega) / so * a + math.sin(t * omega) / so * b)
+    return pygame.math.Vector2(*slerpArray(a, b, t))
 
 def randAngle():
     mul = (1, -1)
@@ -55,4 +55,65 @@ def randAngle():
     
 def anglesApproxEqual(a, b, deviation = .2):
     return abs(a[0] - b[0]) <= deviation and abs(a[1] - b[1]) <= deviation
+
+#The following are versions of the above which work on many vectors at
+#once, given as NumPy arrays of shape (n, 2) and returning arrays.
+#Anything which can be broadcast to that shape, such as a single
+#vector, may be passed instead.
+
+def fromRadiansArray(angles):
+    angles = numpy.asarray(angles, numpy.float64)
+    
+    return numpy.stack((numpy.cos(angles), numpy.sin(angles)), -1)
+
+def toRadiansArray(vectors):
+    vectors = numpy.asarray(vectors, numpy.float64)
+    
+    return numpy.arctan2(vectors[..., 0], -vectors[..., 1])
+
+def normalizeArray(vectors):
+    """Unit vectors in the direction of each vector, leaving zero
+       vectors as zero."""
+    
+    vectors = numpy.asarray(vectors, numpy.float64)
+    lengths = numpy.hypot(vectors[..., 0], vectors[..., 1])[..., None]
+    
+    return numpy.divide(vectors, lengths, out = numpy.zeros_like(vectors),
+                        where = lengths != 0)
+
+def angleBetweenArray(a, b):
+    return normalizeArray(numpy.subtract(b, a, dtype = numpy.float64))
+
+def facingArray(vectors):
+    return normalizeArray(numpy.round(normalizeArray(vectors)))
+
+def anglesApproxEqualArray(a, b, deviation = .2):
+    return (numpy.abs(numpy.subtract(a, b, dtype = numpy.float64))
+            <= deviation).all(-1)
+
+def slerpArray(a, b, t = 0):
+    a = numpy.asarray(a, numpy.float64)
+    b = numpy.asarray(b, numpy.float64)
+    t = numpy.asarray(t, numpy.float64)[..., None]
+    
+    cosOmega = numpy.clip((normalizeArray(a) * normalizeArray(b)).sum(-1),
+                          -1, 1)[..., None]
+    omega = numpy.arccos(cosOmega)
+    so = numpy.sin(omega)
+    
+    #Nearly parallel vectors have no well defined plane to rotate in,
+    #so are interpolated linearly instead.
+    
+    parallel = so < 1e-6
+    so = numpy.where(parallel, 1, so)
+    
+    weightA = numpy.where(parallel, 1 - t, numpy.sin((1 - t) * omega) / so)
+    weightB = numpy.where(parallel, t, numpy.sin(t * omega) / so)
+    
+    result = weightA * a + weightB * b
+    
+    #As before, interpolating from or to nothing gives nothing.
+    
+    zero = ((a == 0).all(-1) | (b == 0).all(-1))[..., None]
     
+    return numpy.where(zero, 0, result)
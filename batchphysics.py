@@ -0,0 +1,205 @@
+#batchphysics.py
+
+#This file steps many copies of the same world at once. A BatchWorld is
+#made from a PhysicsManager whose objects define the scene, and holds
+#the state of K independent copies of it in NumPy arrays shaped
+#(K, number of objects, 2), so that one call to step advances every
+#copy. This is meant for running the same small game thousands of
+#times, for instance when training AIs.
+
+#The copies follow the same rules as PhysicsManager: objects move one
+#axis at a time and stop on that axis if the move would overlap
+#anything, gravity and resistance are applied afterwards, and kinematic
+#and immobile objects are not moved by collisions. Collisions are
+#resolved symmetrically, as one dimensional collisions along the axis of
+#the move, rather than in the order objects happen to be updated.
+#Collision hooks are not called, and velocities are always integrated
+#after moving, as by the legacy solver's "euler" integrator, whichever
+#integrator the manager uses.
+
+import numpy
+import pygame
+
+import shapes
+
+class BatchWorld():
+    def __init__(self, physicsManager, numWorlds):
+        self.physicsManager = physicsManager
+        self.objects = list(physicsManager.objects)
+        self.numWorlds = numWorlds
+
+        n = len(self.objects)
+
+        self.isCircle = numpy.zeros(n, numpy.bool_)
+        self.halfSize = numpy.zeros((n, 2)) #Radius for circles.
+        centres = numpy.zeros((n, 2))
+
+        for i, object_ in enumerate(self.objects):
+            collider = object_.collider
+
+            if isinstance(collider, shapes.CompactCircle):
+                self.isCircle[i] = True
+                self.halfSize[i] = collider.radius
+                centres[i] = collider.centre
+            elif isinstance(collider, shapes.CompactRect):
+                self.halfSize[i] = (collider.width / 2, collider.height / 2)
+                centres[i] = (collider.float_x + self.halfSize[i][0],
+                              collider.float_y + self.halfSize[i][1])
+            else:
+                raise ValueError("Colliders must be Circles or Rects")
+
+        self.mass = numpy.array([object_.mass for object_ in self.objects],
+                                numpy.float64)
+        self.bounciness = numpy.array([object_.bounciness
+                                       for object_ in self.objects],
+                                      numpy.float64)
+        self.immobile = numpy.array([object_.immobile
+                                     for object_ in self.objects],
+                                    numpy.bool_)
+        self.kinematic = numpy.array([object_.kinematic
+                                      for object_ in self.objects],
+                                     numpy.bool_)
+
+        self.dynamic = ~self.kinematic & ~self.immobile
+        self.invMass = numpy.where(self.dynamic, 1 / self.mass, 0)
+
+        self.templatePos = centres
+        self.templateVelocity = numpy.array([tuple(object_.velocity)
+                                             for object_ in self.objects],
+                                            numpy.float64).reshape(n, 2)
+        self.templateAcceleration = numpy.array(
+            [tuple(object_.acceleration) for object_ in self.objects],
+            numpy.float64).reshape(n, 2)
+
+        self.pos = None
+        self.velocity = None
+        self.acceleration = None
+
+        self.reset()
+
+    def reset(self, worlds = None):
+        """Return the given worlds, or all of them, to the template's
+           starting state"""
+
+        if self.pos is None:
+            shape = (self.numWorlds,) + self.templatePos.shape
+
+            self.pos = numpy.empty(shape)
+            self.velocity = numpy.empty(shape)
+            self.acceleration = numpy.empty(shape)
+
+        if worlds is None:
+            worlds = slice(None)
+
+        self.pos[worlds] = self.templatePos
+        self.velocity[worlds] = self.templateVelocity
+        self.acceleration[worlds] = self.templateAcceleration
+
+    def overlaps(self, moved, still):
+        """For every world, whether each object at its position in moved
+           overlaps each other object at its position in still. Returns
+           a (K, n, n) boolean array."""
+
+        d = moved[:, :, None, :] - still[:, None, :, :]
+        hi = self.halfSize[:, None, :]
+        hj = self.halfSize[None, :, :]
+
+        circleI = self.isCircle[:, None]
+        circleJ = self.isCircle[None, :]
+
+        #Circle against circle.
+        radii = hi[..., 0] + hj[..., 0]
+        circles = (d ** 2).sum(-1) < radii ** 2
+
+        #Rect against rect.
+        rects = (numpy.abs(d) < hi + hj).all(-1)
+
+        #Circle i against rect j, and rect i against circle j, by the
+        #distance from the circle's centre to the closest point in the
+        #rect.
+        toRectJ = d - numpy.clip(d, -hj, hj)
+        circleRect = (toRectJ ** 2).sum(-1) < hi[..., 0] ** 2
+
+        toRectI = -d - numpy.clip(-d, -hi, hi)
+        rectCircle = (toRectI ** 2).sum(-1) < hj[..., 0] ** 2
+
+        result = numpy.where(circleI & circleJ, circles,
+                 numpy.where(circleI, circleRect,
+                 numpy.where(circleJ, rectCircle, rects)))
+
+        n = len(self.objects)
+        result[:, numpy.arange(n), numpy.arange(n)] = False
+
+        return result
+
+    def moveAxis(self, axis, dt):
+        moving = ~self.immobile
+
+        trial = self.pos.copy()
+        trial[..., axis] += numpy.where(moving,
+                                        self.velocity[..., axis] * dt, 0)
+
+        hit = self.overlaps(trial, self.pos) & moving[None, :, None]
+        anyHit = hit.any(-1)
+
+        self.pos[..., axis] = numpy.where(anyHit, self.pos[..., axis],
+                                          trial[..., axis])
+
+        #One dimensional collisions between each pair which hit along
+        #this axis and are moving towards each other.
+
+        v = self.velocity[..., axis]
+        relative = v[:, None, :] - v[:, :, None] #v_j - v_i
+        offset = (self.pos[..., axis][:, None, :] -
+                  self.pos[..., axis][:, :, None]) #pos_j - pos_i
+
+        approaching = relative * numpy.sign(offset) < 0
+
+        invI = self.invMass[:, None]
+        invJ = self.invMass[None, :]
+        invTotal = invI + invJ
+
+        restitution = (self.bounciness[:, None] +
+                       self.bounciness[None, :]) / 2
+
+        share = numpy.divide(invI, invTotal, out = numpy.zeros_like(invTotal),
+                             where = invTotal > 0)
+
+        response = hit & approaching
+        response = response | response.transpose(0, 2, 1)
+
+        self.velocity[..., axis] += (response * (1 + restitution) * share *
+                                     relative).sum(-1)
+
+    def step(self, dt):
+        """Advance every world by dt seconds"""
+
+        self.moveAxis(0, dt)
+        self.moveAxis(1, dt)
+
+        manager = self.physicsManager
+        dynamic = self.dynamic[None, :, None]
+
+        #As in PhysicsManager.integrateForces, with explicit Euler.
+
+        resistance = manager.calcResistance(self.velocity, dt)
+
+        self.velocity += dynamic * (numpy.array(manager.g) +
+                                    self.acceleration + resistance /
+                                    self.mass[None, :, None]) * dt
+
+    def writeBack(self, world = 0):
+        """Copy one world's state onto the template's objects, for
+           instance to draw it"""
+
+        for i, object_ in enumerate(self.objects):
+            centre = self.pos[world, i]
+
+            if self.isCircle[i]:
+                object_.collider.setPos(centre)
+            else:
+                object_.collider.setPos(centre - self.halfSize[i])
+
+            object_.velocity = pygame.math.Vector2(*self.velocity[world, i])
+            object_.acceleration = pygame.math.Vector2(
+                *self.acceleration[world, i])
@@ -0,0 +1,648 @@
+#benchmarks.py
+
+#Timings for the engine's performance sensitive paths. Run this file
+#directly to print the results of every benchmark.
+
+import math
+import os
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+def timed(func, *args, repeat = 5, **kwargs):
+    """Return the best time in seconds of several calls to func"""
+
+    best = None
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+def report(name, seconds):
+    print("{:<40} {:>10.3f} ms".format(name, seconds * 1000))
+
+def benchmarkGridSaveLoad(size = (100, 100), numImgs = 8,
+                          filename = "grid_benchmark.npz"):
+    import grid
+
+    surface = pygame.Surface((size[0] * 32, size[1] * 32))
+    g = grid.Grid(surface, size)
+
+    imgs = []
+
+    for i in range(numImgs):
+        img = pygame.Surface((32, 32))
+        img.fill((i * 30 % 256, 100, 200))
+        imgs.append(img)
+
+    for i, tile in enumerate(g.getTiles()):
+        tile.addImg(imgs[i % numImgs])
+        tile.addTag("wall" if i % 7 == 0 else "floor")
+
+    data = g.toData()
+
+    report("Grid.toData", timed(g.toData))
+    report("Grid.fromData", timed(grid.Grid.fromData, data, surface,
+                                   repeat = 1))
+    report("Grid.save", timed(g.save, filename))
+    report("Grid.load", timed(grid.Grid.load, filename, surface))
+    report("Grid.load and every tile",
+           timed(lambda : list(grid.Grid.load(filename, surface).getTiles())))
+
+    os.remove(filename)
+
+def benchmarkSnapshotRestore(numObjects = 1000):
+    import physics
+    import shapes
+
+    world = physics.PhysicsManager(makeCurrent = False)
+
+    for i in range(numObjects):
+        if i % 2:
+            collider = shapes.Circle((i % 100, i // 100), 5)
+        else:
+            collider = shapes.Rect((i % 100, i // 100), (10, 10))
+
+        physics.PhysicsObject(collider.getPos(), collider,
+                              velocity = (i, -i), physicsManager = world)
+
+    snapshot = world.snapshot()
+
+    report("snapshot ({} objects)".format(numObjects),
+           timed(world.snapshot, snapshot))
+    report("restore ({} objects)".format(numObjects),
+           timed(world.restore, snapshot))
+
+def measureTunnelling(dt, ccd, trials = 100, speed = 1200):
+    """The fraction of fast balls fired at a thin wall which pass
+       through it, when stepping the simulation by dt"""
+
+    import random
+
+    import angle
+    import physics
+    import shapes
+
+    world = physics.PhysicsManager(makeCurrent = False)
+    world.g = angle.ZERO
+
+    physics.PhysicsObject((200, 0), shapes.Rect((200, 0), (2, 400)),
+                          kinematic = True, immobile = True,
+                          physicsManager = world)
+
+    ball = physics.PhysicsObject((100, 200), shapes.Circle((100, 200), 3),
+                                 ccd = ccd, physicsManager = world)
+
+    rng = random.Random(0)
+    tunnelled = 0
+
+    for i in range(trials):
+        ball.collider.setPos((100 + rng.uniform(0, 20),
+                              rng.uniform(50, 350)))
+        ball.velocity = pygame.math.Vector2(speed, 0)
+
+        while 0 < ball.collider.centre[0] < 400:
+            world.update(dt)
+
+            if ball.velocity[0] < 0:
+                break
+
+        if ball.collider.centre[0] > 200:
+            tunnelled += 1
+
+    return tunnelled / trials
+
+def benchmarkTunnelling(steps = (1 / 240, 1 / 120, 1 / 60, 1 / 30)):
+    for dt in steps:
+        for ccd in (False, True):
+            print("tunnelling at dt = 1/{:<4} ccd = {!s:<5} {:>6.0%}".format(
+                round(1 / dt), ccd, measureTunnelling(dt, ccd)))
+
+def benchmarkStaticBroadphase(numStatic = 300, numMoving = 20, frames = 10):
+    """Update a world of many immobile platforms and a few balls, the
+       case where skipping pairs of immobile objects matters"""
+
+    import angle
+    import physics
+    import shapes
+
+    world = physics.PhysicsManager(makeCurrent = False)
+    world.g = angle.ZERO
+
+    for i in range(numStatic):
+        pos = (i % 30 * 40, i // 30 * 40)
+        physics.PhysicsObject(pos, shapes.Rect(pos, (20, 4)),
+                              kinematic = True, immobile = True,
+                              physicsManager = world)
+
+    for i in range(numMoving):
+        pos = (i * 50 + 10, 20)
+        physics.PhysicsObject(pos, shapes.Circle(pos, 3),
+                              velocity = (30, 60), physicsManager = world)
+
+    def run():
+        for i in range(frames):
+            world.update(1 / 60)
+
+    report("update ({} static, {} moving) x{}".format(numStatic, numMoving,
+                                                     frames),
+           timed(run, repeat = 3))
+
+def benchmarkSpawningAmongStatic(numStatic = 2000, frames = 100):
+    """Spawn and destroy a ball every frame among many immobile tiles,
+       which shouldn't make the tiles be sorted again"""
+
+    import angle
+    import physics
+    import shapes
+
+    world = physics.PhysicsManager(makeCurrent = False)
+    world.g = angle.ZERO
+
+    for i in range(numStatic):
+        pos = (i % 50 * 20, i // 50 * 20 + 100)
+        physics.PhysicsObject(pos, shapes.Rect(pos, (20, 20)),
+                              kinematic = True, immobile = True,
+                              physicsManager = world)
+
+    world.update(1 / 60)
+
+    def run():
+        for i in range(frames):
+            pos = (500, 50)
+            ball = physics.PhysicsObject(pos, shapes.Circle(pos, 5),
+                                         physicsManager = world)
+            world.update(1 / 60)
+            ball.destroy()
+
+    report("spawn and destroy among {} static x{}".format(numStatic, frames),
+           timed(run, repeat = 3))
+
+def benchmarkAngles(n = 10000):
+    import random
+
+    import numpy
+
+    import angle
+
+    rng = random.Random(0)
+
+    a = [(rng.uniform(-100, 100), rng.uniform(-100, 100)) for i in range(n)]
+    b = [(rng.uniform(-100, 100), rng.uniform(-100, 100)) for i in range(n)]
+    arrayA = numpy.array(a)
+    arrayB = numpy.array(b)
+
+    report("angleBetween x{}".format(n),
+           timed(lambda : [angle.angleBetween(p, q) for p, q in zip(a, b)]))
+    report("angleBetweenArray x{}".format(n),
+           timed(angle.angleBetweenArray, arrayA, arrayB))
+    report("slerpArray x{}".format(n),
+           timed(angle.slerpArray, arrayA, arrayB, 0.5))
+
+def benchmarkText(numChars = 40):
+    import gui
+
+    pygame.font.init()
+    font = pygame.font.Font(None, 32)
+
+    def uncached():
+        for i in range(100):
+            font.render("Score: 10 - 7", True, (255, 255, 255))
+
+    def cached():
+        for i in range(100):
+            gui.renderText(font, "Score: 10 - 7", True, (255, 255, 255))
+
+    box = gui.InputBox(font, (255, 255, 255), (0, 0),
+                       pygame.Surface((800, 100)))
+
+    def typing():
+        for i in range(numChars):
+            box.key_input(pygame.K_a + i % 26, True)
+
+        for i in range(numChars):
+            box.key_input(pygame.K_BACKSPACE, True)
+
+    report("font.render x100", timed(uncached))
+    report("gui.renderText x100", timed(cached))
+    report("InputBox typing and deleting {} chars".format(numChars),
+           timed(typing))
+
+def benchmarkButtons(numButtons = 500, frames = 100):
+    """Polling every button each frame against a GUIManager handling a
+       mouse motion event each frame"""
+
+    import gui
+
+    pygame.display.init() #Buttons poll the mouse through it.
+
+    surface = pygame.Surface((1000, 1000))
+    img = pygame.Surface((20, 20))
+
+    buttons = [gui.Button(img, (i % 40 * 25, i // 40 * 25), surface = surface)
+               for i in range(numButtons)]
+
+    manager = gui.GUIManager(surface)
+
+    for button in buttons:
+        manager.add(button)
+
+    manager.draw()
+
+    events = [pygame.event.Event(pygame.MOUSEMOTION, pos = (i * 7, i * 3),
+                                 rel = (7, 3), buttons = (0, 0, 0))
+              for i in range(frames)]
+
+    def polling():
+        for i in range(frames):
+            for button in buttons:
+                button.update()
+
+    def managed():
+        for event in events:
+            manager.handleEvent(event)
+            manager.draw()
+
+    report("Button.update {} buttons x{}".format(numButtons, frames),
+           timed(polling, repeat = 3))
+    report("GUIManager {} buttons x{}".format(numButtons, frames),
+           timed(managed, repeat = 3))
+
+def benchmarkMergeRects(counts = (100, 800), size = 8):
+    """Merge the dirty rects of many small sprites, most of which don't
+       overlap"""
+
+    import random
+
+    import game
+
+    random.seed(0)
+
+    for n in counts:
+        rects = [pygame.Rect(random.randint(0, 800), random.randint(0, 600),
+                             random.randint(2, size), random.randint(2, size))
+                 for i in range(n)]
+
+        report("mergeRects {} rects".format(n),
+               timed(game.mergeRects, rects))
+
+def benchmarkImport(module = "game", budget = 0.05):
+    """Time importing a module in a fresh interpreter, not counting
+       pygame's own import, and check it is within budget seconds"""
+
+    import subprocess
+    import sys
+
+    code = ("import time, pygame\n"
+            "start = time.perf_counter()\n"
+            "import {}\n"
+            "print(time.perf_counter() - start)").format(module)
+
+    output = subprocess.run([sys.executable, "-c", code],
+                            cwd = os.path.dirname(os.path.abspath(__file__)),
+                            stdout = subprocess.PIPE, check = True,
+                            universal_newlines = True).stdout
+
+    seconds = float(output.split()[-1])
+    report("import {}".format(module), seconds)
+
+    if seconds > budget:
+        print("import {} is over its budget of {} ms".format(module,
+                                                            budget * 1000))
+
+def benchmarkSpawning(numObjects = 1000, rounds = 10):
+    """Spawning and removing objects, new each time or from a pool"""
+
+    import physics
+    import shapes
+
+    world = physics.PhysicsManager(makeCurrent = False)
+
+    def make(pos = (0, 0), velocity = (0, 0), acceleration = (0, 0)):
+        return physics.PhysicsObject(pos, shapes.Circle(pos, 3),
+                                     velocity = velocity,
+                                     acceleration = acceleration,
+                                     physicsManager = world)
+
+    def unpooled():
+        for i in range(rounds):
+            objects = [make((j, j)) for j in range(numObjects)]
+
+            for object_ in objects:
+                object_.destroy()
+
+    pool = physics.ObjectPool(make)
+
+    def pooled():
+        for i in range(rounds):
+            objects = [pool.acquire((j, j)) for j in range(numObjects)]
+
+            for object_ in objects:
+                pool.release(object_)
+
+    report("spawn and destroy {} x{}".format(numObjects, rounds),
+           timed(unpooled, repeat = 3))
+    report("ObjectPool {} x{}".format(numObjects, rounds),
+           timed(pooled, repeat = 3))
+
+def bytesPerObject(make, n = 10000):
+    """The memory allocated per object when making n of them"""
+
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [make(i) for i in range(n)]
+    size = tracemalloc.get_traced_memory()[0] - start
+
+    tracemalloc.stop()
+    del objects
+
+    return size / n
+
+#The state each shape, particle and tile kept in its __dict__ before the
+#Compact variants were added, for benchmarkMemory to compare them with.
+
+class BaselineCircle():
+    def __init__(self, centre, radius):
+        self.id = id(self)
+        self.args = [centre, radius, None, (0, 0, 0), self.id]
+        self.centre = pygame.math.Vector2(centre)
+        self.radius = radius
+        self.area = math.pi * radius ** 2
+        self.surface = pygame.display.get_surface()
+        self.colour = (0, 0, 0)
+
+class BaselineRect(pygame.Rect):
+    def __init__(self, pos, size):
+        pygame.Rect.__init__(self, pos, size)
+
+        self.id = id(self)
+        self.args = [pos, size, None, (0, 0, 0), self.id]
+        self.centre = pygame.math.Vector2(self.center)
+        self.area = size[0] * size[1]
+        self.surface = pygame.display.get_surface()
+        self.colour = (0, 0, 0)
+        self.float_x = float(self.x)
+        self.float_y = float(self.y)
+
+class BaselineParticle():
+    def __init__(self, pos, colour, velocity):
+        self.pos = pygame.math.Vector2(pos)
+        self.velocity = pygame.math.Vector2(velocity)
+        self.size = (1, 1)
+        self.colour = colour
+        self.lifespan = None
+        self.timeAlive = 0
+        self.surface = pygame.display.get_surface()
+        self.surfrect = None
+
+class BaselineTile(pygame.Rect):
+    def __init__(self, point, size):
+        self.size = [int(i) for i in size]
+        self.point = point
+        self.colour = None
+        self.imgs = []
+        self.tags = []
+
+        pygame.Rect.__init__(self, self.point, self.size)
+
+def benchmarkMemory(n = 10000):
+    """Bytes per object of each shape, particle and tile before the
+       Compact variants, with a __dict__, and as a Compact variant"""
+
+    import grid
+    import particles
+    import shapes
+
+    groups = ((BaselineCircle, shapes.Circle, shapes.CompactCircle,
+               lambda cls, i : cls((i, i), 5)),
+              (BaselineRect, shapes.Rect, shapes.CompactRect,
+               lambda cls, i : cls((i, i), (10, 10))),
+              (BaselineParticle, particles.Particle,
+               particles.CompactParticle,
+               lambda cls, i : cls((i, i), (255, 255, 255), (1, 0))),
+              (BaselineTile, grid.Tile, grid.CompactTile,
+               lambda cls, i : cls((i, i), (32, 32))))
+
+    for classes in groups:
+        make = classes[-1]
+
+        for c in classes[:-1]:
+            print("{:<40} {:>10.0f} bytes".format(
+                c.__name__ + " per object",
+                bytesPerObject(lambda i : make(c, i), n)))
+
+    del particles.ParticleManager.particles[:]
+
+def benchmarkQuadTree(sizes = (1000, 10000, 100000), queries = 100):
+    """Build a quadtree of tiles and small circles and query it, against
+       looking at every shape"""
+
+    import heapq
+    import random
+
+    import quadtree
+    import shapes
+
+    random.seed(0)
+    surface = pygame.Surface((1, 1))
+
+    for n in sizes:
+        worldSize = int((n * 400) ** 0.5) #Keep the density the same.
+
+        items = []
+
+        for i in range(n):
+            pos = (random.uniform(0, worldSize), random.uniform(0, worldSize))
+
+            if i % 2:
+                items.append(shapes.CompactRect(pos, (16, 16), surface))
+            else:
+                items.append(shapes.CompactCircle(pos, random.uniform(2, 8),
+                                                  surface))
+
+        bounds = [quadtree.boundsOf(item) for item in items]
+        areas = [(x, y, x + 64, y + 64) for x, y in
+                 ((random.uniform(0, worldSize), random.uniform(0, worldSize))
+                  for i in range(queries))]
+
+        tree = quadtree.QuadTree((0, 0, worldSize + 16, worldSize + 16))
+
+        report("quadtree build x{}".format(n), timed(tree.build, items,
+                                                     repeat = 3))
+
+        def treeRanges():
+            for area in areas:
+                tree.queryBounds(area)
+
+        def linearRanges():
+            for area in areas:
+                [item for item, itemBounds in zip(items, bounds)
+                 if quadtree.overlaps(itemBounds, area)]
+
+        def treeNearest():
+            for area in areas:
+                tree.nearest(area[:2], 5)
+
+        def linearNearest():
+            for area in areas[:10]: #Too slow to do them all.
+                heapq.nsmallest(5, zip(bounds, items), key = lambda entry :
+                                quadtree.boundsDistanceSquared(entry[0],
+                                                               area[:2]))
+
+        report("  range x{} (quadtree)".format(queries),
+               timed(treeRanges, repeat = 3))
+        report("  range x{} (linear)".format(queries),
+               timed(linearRanges, repeat = 1))
+        report("  5 nearest x{} (quadtree)".format(queries),
+               timed(treeNearest, repeat = 3))
+        report("  5 nearest x{} (linear)".format(len(areas[:10])),
+               timed(linearNearest, repeat = 1))
+
+def benchmarkQueries(numObjects = 2000, numAgents = 200, reach = 200):
+    """Cast a ray and look around each of many agents, one at a time, in
+       one batch and by checking every object"""
+
+    import random
+
+    import physics
+    import shapes
+
+    random.seed(0)
+    surface = pygame.Surface((1, 1))
+    world = physics.PhysicsManager(makeCurrent = False)
+
+    for i in range(numObjects):
+        pos = (random.uniform(0, 2000), random.uniform(0, 2000))
+        physics.PhysicsObject(pos, shapes.Circle(pos, 5, surface),
+                              immobile = i % 2 == 0, physicsManager = world)
+
+    origins = [(random.uniform(0, 2000), random.uniform(0, 2000))
+               for i in range(numAgents)]
+    directions = [(random.uniform(-1, 1), random.uniform(-1, 1))
+                  for i in range(numAgents)]
+
+    def linear():
+        for origin, direction in zip(origins, directions):
+            motion = pygame.math.Vector2(direction)
+            motion.scale_to_length(reach)
+
+            min(((t, i) for t, i in
+                 ((shapes.rayCircle(origin, motion, object_.collider.centre,
+                                    object_.collider.radius), i)
+                  for i, object_ in enumerate(world.objects))
+                 if t is not None), default = None)
+
+            [object_ for object_ in world.objects
+             if object_.collider.centre.distance_to(origin) -
+             object_.collider.radius <= reach]
+
+    def single():
+        for origin, direction in zip(origins, directions):
+            world.raycast(origin, direction, reach)
+            world.queryRadius(origin, reach)
+
+    def batch():
+        world.raycastBatch(origins, directions, reach)
+        world.queryRadiusBatch(origins, reach)
+
+    probes = [shapes.Circle(origin, 5, surface) for origin in origins]
+    motions = [pygame.math.Vector2(direction) * reach
+               for direction in directions]
+    rects = [pygame.Rect(origin, (reach, reach)) for origin in origins]
+
+    def singleShapes():
+        for probe, motion, rect in zip(probes, motions, rects):
+            world.shapecast(probe, motion)
+            world.queryRect(rect)
+
+    def batchShapes():
+        world.shapecastBatch(probes, motions)
+        world.queryRectBatch(rects)
+
+    name = "ray and radius x{} ({} objects)".format(numAgents, numObjects)
+
+    report(name + " linear", timed(linear, repeat = 3))
+    report(name + " single", timed(single, repeat = 3))
+    report(name + " batch", timed(batch, repeat = 3))
+
+    name = "shapecast and rect x{} ({} objects)".format(numAgents,
+                                                       numObjects)
+
+    report(name + " single", timed(singleShapes, repeat = 3))
+    report(name + " batch", timed(batchShapes, repeat = 3))
+
+def benchmarkForces(numObjects = 1000, frames = 60):
+    """Integrate gravity, accelerations and resistance for many objects
+       at once, against doing so one object at a time"""
+
+    import physics
+    import shapes
+
+    surface = pygame.Surface((1, 1))
+    world = physics.PhysicsManager(makeCurrent = False,
+                                   resistance = (-0.01, -0.01))
+
+    for i in range(numObjects):
+        pos = (i % 40 * 20, i // 40 * 20)
+        physics.PhysicsObject(pos, shapes.Circle(pos, 5, surface),
+                              velocity = (i % 7 - 3, i % 5 - 2),
+                              acceleration = (1, 0), physicsManager = world)
+
+    def perObject():
+        for i in range(frames):
+            for object_ in world.objects:
+                r = pygame.math.Vector2(world.resistance)
+
+                for axis in (0, 1):
+                    if object_.velocity[axis] < 0:
+                        r[axis] *= -1
+                    if object_.velocity[axis] == 0:
+                        r[axis] = 0
+
+                object_.applyAcceleration(world.g, 1 / 60)
+                object_.applyAcceleration(object_.acceleration, 1 / 60)
+                object_.applyAcceleration(
+                    r * object_.velocity.length_squared() / 60 /
+                    object_.mass, 1 / 60)
+
+    def batched():
+        for i in range(frames):
+            world.integrateForces(world.objects, 1 / 60)
+
+    report("forces x{} per object ({})".format(frames, numObjects),
+           timed(perObject, repeat = 3))
+    report("forces x{} at once ({})".format(frames, numObjects),
+           timed(batched, repeat = 3))
+
+def main():
+    benchmarkImport()
+    benchmarkGridSaveLoad()
+    benchmarkSnapshotRestore()
+    benchmarkTunnelling()
+    benchmarkStaticBroadphase()
+    benchmarkSpawningAmongStatic()
+    benchmarkAngles()
+    benchmarkText()
+    benchmarkButtons()
+    benchmarkMergeRects()
+    benchmarkSpawning()
+    benchmarkMemory()
+    benchmarkQuadTree()
+    benchmarkQueries()
+    benchmarkForces()
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,82 @@
 import sys
+import math
 import pygame
 import threading
-from fractions import gcd
-from grid import Grid
+import shapes
+from contextlib import nullcontext
+
+NOT_PROFILING = nullcontext() #Used for every phase when not profiling.
+
+_keycodes = None
 
 def getKeycodes():
     """A method to get all the keycodes
-     used in pygame in to a dictionary"""
-    
-    keycodes = {item[2:].lower() : eval("pygame." + item)
-                for item in dir(pygame) if "K_" in item}
+     used in pygame in to a dictionary. They are found the first time
+     they are asked for, rather than whenever this module is imported."""
+
+    global _keycodes
+
+    if _keycodes is None:
+        _keycodes = {item[2:].lower() : getattr(pygame, item)
+                     for item in dir(pygame) if item.startswith("K_")}
     
-    return keycodes
+    return _keycodes
+
+def __getattr__(name):
+    if name == "KEYCODES":
+        return getKeycodes()
 
-KEYCODES = getKeycodes()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                    name))
 
 def key(key):
-    return KEYCODES[key]
+    return getKeycodes()[key]
 
 def calcAspectRatio(width, height):
-    hcf = gcd(width, height)
+    hcf = math.gcd(int(width), int(height))
     return (width / hcf, height / hcf)
 
+def mergeRects(rects):
+    """Merge overlapping rects into their unions until none overlap.
+       Sweeping across the rects from left to right, each is only
+       checked against those it reaches across, and sweeps are repeated
+       until one merges nothing, as unions may grow to overlap rects
+       already passed."""
+
+    merged = [pygame.Rect(rect) for rect in rects]
+    count = None
+
+    while len(merged) != count:
+        count = len(merged)
+        merged.sort(key = lambda rect : rect.left)
+
+        passed = [] #Rects ending before the sweep, which it can't reach.
+        active = []
+
+        for rect in merged:
+            reaching = []
+
+            for other in active:
+                if other.right > rect.left:
+                    reaching.append(other)
+                else:
+                    passed.append(other)
+
+            active = reaching
+            hits = rect.collidelistall(active)
+
+            while hits:
+                for i in reversed(hits):
+                    rect.union_ip(active.pop(i))
+
+                hits = rect.collidelistall(active) #Our union has grown.
+
+            active.append(rect)
+
+        merged = passed + active
+
+    return merged
+
 class Renderer(threading.Thread):
     def __init__(self, RENDERRATE, *renderFuncs):
         self.clock = pygame.time.Clock()
@@ -45,13 +100,25 @@ class Renderer(threading.Thread):
 class Game():
     def __init__(self, WIDTH, HEIGHT, gameName = "", gridsize = None,
                  FRAMERATE = 0, RENDERRATE = None, fillcolour = (0, 0, 0),
-                 screenModifiers = (), timeScale = 1, dt_threshold = 0.2):
-        
-        self.screen = pygame.display.set_mode((WIDTH, HEIGHT), 
-                                              *screenModifiers)
+                 screenModifiers = (), timeScale = 1, dt_threshold = 0.2,
+                 dirtyRendering = False, dirtyThreshold = 0.5,
+                 maxDirtyRects = 256, profile = False, headless = False,
+                 fixedDeltaTime = None):
+
+        self.headless = headless #A headless game opens no window and
+                                 #renders nothing, running its loop as
+                                 #fast as it can.
+
+        if self.headless:
+            self.screen = pygame.Surface((WIDTH, HEIGHT))
+        else:
+            self.screen = pygame.display.set_mode((WIDTH, HEIGHT), 
+                                                  *screenModifiers)
             
         self.gameName = gameName
-        pygame.display.set_caption(self.gameName)
+
+        if not self.headless:
+            pygame.display.set_caption(self.gameName)
             
         self.SCREENSIZE = pygame.math.Vector2(self.screen.get_size())
         self.SCREENRECT = pygame.Rect((0, 0), self.SCREENSIZE)
@@ -66,30 +133,89 @@ class Game():
         self.paused = False
         self.dirtyRects = []
         self.oldDirtyRects = []
+
+        self.dirtyRendering = dirtyRendering and not headless
+                                             #Only update the parts of
+                                             #the screen which changed.
+        self.dirtyThreshold = dirtyThreshold #Fraction of the screen
+                                             #which, if dirty, triggers
+                                             #a full update instead.
+        self.maxDirtyRects = maxDirtyRects #More dirty rects than this
+                                           #also trigger a full update,
+                                           #rather than being merged.
+        self.fullUpdate = True
+
+        self.background = pygame.Surface(self.SCREENSIZE)
+        self.background.fill(self.fillcolour) #Restored under dirty
+                                              #rects each frame.
+
+        if self.dirtyRendering:
+            shapes.dirtyRectHandler = self.addDirtyRect
+            self.screen.blit(self.background, (0, 0))
         
         self.clock = pygame.time.Clock()
         self.FRAMERATE = FRAMERATE
         self.timeScale = timeScale
         self.deltaTime = self.clock.tick(self.FRAMERATE) / 1000 * self.timeScale        
         self.dt_threshold = dt_threshold
+        self.fixedDeltaTime = fixedDeltaTime #If set, every frame
+                                             #simulates this many
+                                             #seconds, however long it
+                                             #really took.
+        self.frameCount = 0
+
+        self.replayRecorder = None #A replay.Recorder recording our
+                                   #inputs.
+        self.replayPlayer = None #A replay.Player whose inputs we
+                                 #replay.
+        self.replayEvents = []
         
         self.particleManager = None
         self.threadedPhysics = False
+        self.gui = None
+
+        if profile:
+            import profiler
+
+            self.profiler = profiler.Profiler()
+        else:
+            self.profiler = None
         
         self.physicsManager = None
         
-        if RENDERRATE is None:
+        if RENDERRATE is None or self.headless:
             self.renderer = None
         else:
             self.renderer = Renderer(RENDERRATE, self.render,
                                      self.updateDisplay)
         
         if gridsize:
+            from grid import Grid
+
             self.grid = Grid(self.screen, gridsize)
             
         self.ended = False
 
+    def addDirtyRect(self, rect, surface = None):
+        """Mark an area of the screen as changed this frame"""
+
+        if surface is None or surface is self.screen:
+            rect = self.SCREENRECT.clip(rect)
+
+            if rect.width and rect.height:
+                self.dirtyRects.append(rect)
+
+    def redrawAll(self):
+        """Update the whole screen next frame"""
+
+        self.fullUpdate = True
+
     def updateDisplay(self):
+        if self.dirtyRendering:
+            shapes.endFrame()
+            self.updateDirtyRects()
+            return
+
         #self.screen.unlock()
         
         if self.dirtyRects:
@@ -100,6 +226,52 @@ class Game():
         #self.screen.lock()
 
         self.screen.fill(self.fillcolour)
+
+    def profile(self, name):
+        """Time a with block as a phase of the frame, if profiling"""
+
+        if self.profiler is None:
+            return NOT_PROFILING
+
+        return self.profiler.phase(name)
+
+    def drawProfiler(self, font, pos = (0, 0), colour = (255, 255, 255)):
+        """Draw the profiler's timings over the screen. Call from
+           render."""
+
+        if self.profiler is None:
+            return
+
+        overlay = self.profiler.renderOverlay(font, colour)
+        self.screen.blit(overlay, pos)
+
+        if self.dirtyRendering:
+            self.addDirtyRect(pygame.Rect(pos, overlay.get_size()))
+
+    def updateDirtyRects(self):
+        """Update only the areas drawn to this frame or the last, then
+           restore the background under them for the next frame"""
+
+        rects = self.dirtyRects + self.oldDirtyRects
+
+        if len(rects) <= self.maxDirtyRects:
+            rects = mergeRects(rects)
+            dirtyArea = sum(rect.width * rect.height for rect in rects)
+        else:
+            dirtyArea = math.inf #Too many to be worth merging.
+
+        if (self.fullUpdate or
+            dirtyArea > self.dirtyThreshold * self.WIDTH * self.HEIGHT):
+
+            pygame.display.update()
+            self.screen.blit(self.background, (0, 0))
+            self.fullUpdate = False
+
+        else:
+            pygame.display.update(rects)
+
+            for rect in rects:
+                self.screen.blit(self.background, rect, rect)
         
     def setup(self):
         """Hook for setup"""
@@ -129,14 +301,50 @@ class Game():
         """Hook for post-physics update"""
         pass
     
+    def getEvents(self):
+        """Get this frame's events, from pygame or a replay"""
+
+        if self.replayPlayer:
+            return self.replayEvents
+
+        if self.headless:
+            return [] #There is no window to receive events from.
+
+        return pygame.event.get()
+
     def handleInputs(self):
         """Input handling"""
+
+        events = self.getEvents()
+
+        if self.replayRecorder:
+            self.replayRecorder.recordFrame(self.deltaTime, events)
         
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 self.quit()
+
+            if self.gui and self.gui.handleEvent(event):
+                continue #A widget used the event.
                 
             self.handleEvent(event)
+
+    def record(self, file, seed = None):
+        """Record the game's inputs to a file, to replay later. Call
+           before run."""
+
+        import replay
+
+        self.replayRecorder = replay.Recorder(file, seed)
+
+    def replay(self, file):
+        """Replay recorded inputs instead of taking real ones, ending
+           the game when the recording ends. Call before run. Headless
+           games replay as fast as possible."""
+
+        import replay
+
+        self.replayPlayer = replay.Player(file)
                 
     def initParticles(self):
         try:
@@ -146,11 +354,41 @@ class Game():
             raise ImportError("Particle library not found")
         
         self.particles = particles
+        self.particles.defaultSurface = self.screen
         self.particleManager = self.particles.ParticleManager()
         
         if self.renderer:
             self.renderer.addRenderFunc(self.particleManager.render)
         
+    def initGUI(self, cellSize = 64):
+        """Create a GUIManager for our widgets. When dirty rendering,
+           widgets are drawn onto the background, so that they are only
+           redrawn when they change."""
+
+        import gui
+
+        if self.dirtyRendering:
+            surface = self.background
+        else:
+            surface = self.screen
+
+        self.gui = gui.GUIManager(surface, cellSize)
+
+        if self.renderer:
+            funcs = self.renderer.renderFuncs
+            funcs.insert(funcs.index(self.updateDisplay), self.drawGUI)
+
+        return self.gui
+
+    def drawGUI(self):
+        if not self.dirtyRendering:
+            self.gui.drawAll()
+            return
+
+        for rect in self.gui.draw():
+            self.screen.blit(self.background, rect, rect)
+            self.addDirtyRect(rect)
+
     def initPhysics(self, threaded = False, *args, **kwargs):
         try:
             import physics
@@ -161,12 +399,44 @@ class Game():
         self.physicsManager = physics.PhysicsManager(*args, **kwargs)
         
         self.physicsManager.updateFunc = self.physicsUpdate        
+        self.physicsManager.profiler = self.profiler
         self.threadedPhysics = threaded
 
         if threaded:
+            #Physics objects should then be drawn at their renderPos(),
+            #taken from the frame state acquired before each render.
+
+            if self.renderer:
+                self.renderer.renderFuncs.insert(0,
+                    self.physicsManager.acquireFrame)
+
+            self.physicsManager.publishFrame()
             self.physicsManager.start()
         
-    def run(self):
+    def tick(self):
+        """Wait for the next frame and get the time it should simulate"""
+
+        if self.headless:
+            realDeltaTime = self.clock.tick() / 1000 #Don't wait.
+        else:
+            realDeltaTime = self.clock.tick(self.FRAMERATE) / 1000
+
+        if self.replayPlayer:
+            frame = self.replayPlayer.readFrame()
+
+            if frame is None:
+                self.end()
+                return 0
+
+            deltaTime, self.replayEvents = frame
+            return deltaTime
+
+        if self.fixedDeltaTime is not None:
+            return self.fixedDeltaTime * self.timeScale
+
+        return realDeltaTime * self.timeScale
+        
+    def run(self, maxFrames = None):
         if self.renderer:
             self.renderer.start()
             
@@ -174,54 +444,93 @@ class Game():
         self.setup()
         
         while not self.ended:
+            if maxFrames is not None and self.frameCount >= maxFrames:
+                break
             
-            self.deltaTime = self.clock.tick(self.FRAMERATE) / 1000 * self.timeScale
+            self.deltaTime = self.tick()
+
+            if self.ended:
+                break
             
-            if self.dt_threshold and self.deltaTime > self.dt_threshold:
+            if (self.dt_threshold and self.fixedDeltaTime is None and
+                self.replayPlayer is None and
+                self.deltaTime > self.dt_threshold):
                 
                 # A large deltaTime value indicates that the window was
                 # being resized or dragged between now and the last 
                 # frame. This large dt value would, if left alone,
                 # cause all sorts of problems for our game, such as 
                 # objects clipping through each other as their movement
-                # is scaled by deltaTime. We thus skip this frame.
+                # is scaled by deltaTime. We thus skip this frame. Fixed
+                # and replayed delta times are never skipped, as they
+                # weren't measured from this run.
                 
                 continue
             
             self.oldDirtyRects = self.dirtyRects
             self.dirtyRects = []
-            
-            self.update()
-            self.handleInputs()
+
+            if self.profiler:
+                self.profiler.beginFrame()
+
+            with self.profile("update"):
+                self.update()
+
+            with self.profile("inputs"):
+                self.handleInputs()
             
             if self.particleManager:
-                if self.renderer is None or True:
-                    self.particleManager.update(self.deltaTime)
+                with self.profile("particles"):
+                    if self.renderer is None or True:
+                        self.particleManager.update(self.deltaTime)
                     
-                else:
-                    self.particleManager.update(self.renderer.deltaTime)
+                    else:
+                        self.particleManager.update(self.renderer.deltaTime)
 
             if self.physicsManager and not self.threadedPhysics:
-                self.physicsManager.update(self.deltaTime)
-                self.physicsUpdate()
-                
-            if not self.renderer:
-                self.drawBackground()
+                with self.profile("physics"):
+                    self.physicsManager.update(self.deltaTime)
+                    self.physicsUpdate()
                 
-                if self.particleManager:
-                    self.particleManager.render()
+            if not self.renderer and not self.headless:
+                with self.profile("render"):
+                    if self.threadedPhysics:
+                        self.physicsManager.acquireFrame()
+
+                    self.drawBackground()
                 
-                self.render()
+                    if self.particleManager:
+                        self.particleManager.render()
                 
-                self.updateDisplay()
+                    self.render()
+
+                    if self.gui:
+                        self.drawGUI()
+
+                with self.profile("display"):
+                    self.updateDisplay()
+
+            if self.profiler:
+                self.profiler.endFrame()
+
+            self.frameCount += 1
             
             if self.returnValue is not None:
+                self.stopRecording()
                 return self.returnValue
+
+        self.stopRecording()
             
     def end(self):
         self.ended = True
+
+    def stopRecording(self):
+        if self.replayRecorder:
+            self.replayRecorder.close()
+            self.replayRecorder = None
     
     def quit(self):
         self.end()
+        self.stopRecording()
         pygame.quit()
         sys.exit(0)
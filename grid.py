@@ -5,9 +5,13 @@
 
 import pygame
 import math
-from fractions import gcd
+import numpy
+import ast
+from collections.abc import MutableSequence
 from functools import reduce
 
+BINARY_VERSION = 1
+
 def _isEven(i):
     return i % 2 == 0
 
@@ -21,10 +25,18 @@ def _range(start, stop, step=1):
         start += step
         
 def _simplify(a, b):
-    hcf = gcd(a, b)
+    hcf = math.gcd(int(a), int(b))
     return (a / hcf, b / hcf)
 
-class Tile(pygame.Rect):
+class CompactTile(pygame.Rect):
+    """A tile holding its state in __slots__, to keep the memory used
+       by large grids down"""
+
+    __slots__ = ("point", "colour", "imgs", "tags")
+
+    tagVersion = 0 #Incremented whenever any tile's tags change, so that
+                   #tag based caches know when to rebuild.
+
     def __init__(self, point, size, colour = None, imgs = [], tags = []):
         self.size = [int(i) for i in size]
         self.point = point
@@ -61,8 +73,10 @@ class Tile(pygame.Rect):
     def fromData(data, baseTile = None):
         tile = Tile(*data)
 
-        if baseTile and isinstance(baseTile, Tile):
-            baseTile = tile
+        if baseTile and isinstance(baseTile, CompactTile):
+            baseTile.__init__(tile.point, tile.size, tile.colour,
+                              tile.imgs, tile.tags)
+            return baseTile
         else:
             return tile
 
@@ -79,12 +93,15 @@ class Tile(pygame.Rect):
             self.tags.extend(tags[0])
         else:
             self.tags.extend(tags)
+        CompactTile.tagVersion += 1
     def hasTag(self, tag):
         return (tag in self.tags)
     def delTag(self, tag):
         self.tags.remove(tag)
+        CompactTile.tagVersion += 1
     def clearTags(self):
         self.tags = []
+        CompactTile.tagVersion += 1
     def addImg(self, img, resize = False):
         if isinstance(img, pygame.Surface):
             if img.get_rect() != self and resize:
@@ -106,6 +123,39 @@ class Tile(pygame.Rect):
         for img in self.imgs:
             surface.blit(img, self)
 
+class Tile(CompactTile):
+    """A CompactTile which can be given other attributes"""
+
+class LazyColumn(MutableSequence):
+    """A column of tiles, each made by makeTile(row) when first used"""
+
+    def __init__(self, length, makeTile):
+        self.tiles = list(range(length)) #The row of each tile not yet
+        self.makeTile = makeTile         #made, in its place.
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        tile = self.tiles[index]
+
+        if isinstance(tile, int):
+            tile = self.tiles[index] = self.makeTile(tile)
+
+        return tile
+
+    def __setitem__(self, index, tile):
+        self.tiles[index] = tile
+
+    def __delitem__(self, index):
+        del self.tiles[index]
+
+    def insert(self, index, tile):
+        self.tiles.insert(index, tile)
+
 class Grid():
     def __init__(self, surface, num, colour = None, tiles = None, 
                  force_square = False):
@@ -136,7 +186,7 @@ class Grid():
         self.colour = colour
 
         if tiles:
-            if hasattr(tiles, "__getitem__") and isinstance(tiles[0], Tile):
+            if hasattr(tiles, "__getitem__") and isinstance(tiles[0][0], CompactTile):
                 self.tiles = tiles
             else:
                 self.tiles = [[Tile.fromData(tile) for tile in column]
@@ -158,6 +208,18 @@ class Grid():
             if tile in column:
                 return self.tiles.index(column), column.index(tile)
 
+    def tileIndex(self, tile):
+        """Find a tile's (column, row) index from its position"""
+
+        return (int(round(tile.point[0] / self.tilesize[0])),
+                int(round(tile.point[1] / self.tilesize[1])))
+
+    def pointIndex(self, point):
+        """Find the (column, row) index of the tile containing a point"""
+
+        return (int(math.floor(point[0] / self.tilesize[0])),
+                int(math.floor(point[1] / self.tilesize[1])))
+
     def getTiles(self):
         """Get all tiles. Returns a generator"""
         for column in self.tiles:
@@ -222,12 +284,10 @@ class Grid():
         dj = (1, 0, -1, 0, 1, -1, 1, -1)
         # indices 0 - 3 are for horizontal, 4 - 7 are for vertical
         
-        index = list(self.getTiles()).index(tile)
-        max_x = self.x - 1 # Offset for 0 indexing
-        max_y = self.y - 1
+        max_x = len(self.tiles) - 1 # Offset for 0 indexing
+        max_y = len(self.tiles[0]) - 1
 
-        i = int(math.floor(index / self.x))
-        j = int(index % self.y)
+        i, j = self.tileIndex(tile)
 
         surroundingTiles = []
 
@@ -280,6 +340,157 @@ class Grid():
 
     def fromData(data, surface):
         return Grid(*([surface] + list(data)))
+
+    def save(self, filename, imgFormat = "RGBA"):
+        """Save the grid in the binary map format. Each distinct image
+           is stored once, and tile colours, images and tags are stored
+           as flat NumPy arrays indexing into the image and tag tables."""
+
+        columns = len(self.tiles)
+        rows = len(self.tiles[0]) if columns else 0
+
+        points = numpy.zeros((columns, rows, 2), numpy.float64)
+        sizes = numpy.zeros((columns, rows, 2), numpy.int32)
+        colours = numpy.zeros((columns, rows, 4), numpy.uint8)
+        hasColour = numpy.zeros((columns, rows), numpy.bool_)
+
+        imgIndex = {} #Maps image data to its index in the image table.
+        imgData = []
+        imgSizes = []
+        tileImgs = []
+        tileImgOffsets = [0]
+
+        tagIndex = {}
+        tileTags = []
+        tileTagOffsets = [0]
+
+        for i, column in enumerate(self.tiles):
+            for j, tile in enumerate(column):
+                points[i, j] = tile.point
+                sizes[i, j] = tile.size
+
+                if tile.colour is not None:
+                    colours[i, j] = tuple(pygame.Color(tile.colour))
+                    hasColour[i, j] = True
+
+                for img in tile.imgs:
+                    data = pygame.image.tostring(img, imgFormat)
+                    key = (data, img.get_size())
+
+                    if key not in imgIndex:
+                        imgIndex[key] = len(imgData)
+                        imgData.append(data)
+                        imgSizes.append(img.get_size())
+
+                    tileImgs.append(imgIndex[key])
+
+                tileImgOffsets.append(len(tileImgs))
+
+                for tag in tile.tags:
+                    #Tags are stored as Python literals, so that they
+                    #load as the same type.
+
+                    text = repr(tag)
+
+                    try:
+                        same = ast.literal_eval(text) == tag
+                    except (ValueError, SyntaxError):
+                        same = False
+
+                    if not same:
+                        raise ValueError("Tags must be literals, such as "
+                                         "strings or numbers, to be saved")
+
+                    tileTags.append(tagIndex.setdefault(text,
+                                                        len(tagIndex)))
+
+                tileTagOffsets.append(len(tileTags))
+
+        imgOffsets = numpy.cumsum([0] + [len(data) for data in imgData])
+        tags = sorted(tagIndex, key = tagIndex.get)
+
+        numpy.savez(filename,
+                    version = numpy.array(BINARY_VERSION),
+                    num = numpy.array(self.num),
+                    colour = numpy.array(() if self.colour is None else
+                                         tuple(pygame.Color(self.colour)),
+                                         numpy.uint8),
+                    imgFormat = numpy.array(imgFormat),
+                    points = points,
+                    sizes = sizes,
+                    colours = colours,
+                    hasColour = hasColour,
+                    imgData = numpy.frombuffer(b"".join(imgData),
+                                               numpy.uint8),
+                    imgOffsets = imgOffsets.astype(numpy.int64),
+                    imgSizes = numpy.array(imgSizes,
+                                           numpy.int32).reshape(-1, 2),
+                    tileImgs = numpy.array(tileImgs, numpy.int32),
+                    tileImgOffsets = numpy.array(tileImgOffsets,
+                                                 numpy.int64),
+                    tags = numpy.array(tags, numpy.str_),
+                    tileTags = numpy.array(tileTags, numpy.int32),
+                    tileTagOffsets = numpy.array(tileTagOffsets,
+                                                 numpy.int64))
+
+    def load(filename, surface):
+        """Load a grid saved with Grid.save. Each tile is only built,
+           and each distinct image only decoded, when first used."""
+
+        with numpy.load(filename) as data:
+            if int(data["version"]) != BINARY_VERSION:
+                raise ValueError("Unsupported grid file version")
+
+            num = data["num"].tolist()
+            colour = data["colour"].tolist()
+            tags = [ast.literal_eval(tag) for tag in data["tags"].tolist()]
+
+            imgFormat = str(data["imgFormat"])
+            imgData = data["imgData"]
+            imgOffsets = data["imgOffsets"]
+            imgSizes = data["imgSizes"]
+
+            points = data["points"]
+            sizes = data["sizes"]
+            colours = data["colours"]
+            hasColour = data["hasColour"]
+            tileImgs = data["tileImgs"]
+            tileImgOffsets = data["tileImgOffsets"]
+            tileTags = data["tileTags"]
+            tileTagOffsets = data["tileTagOffsets"]
+
+        colour = tuple(colour) if colour else None
+        imgs = [None] * len(imgSizes)
+
+        def getImg(index):
+            if imgs[index] is None:
+                start, end = imgOffsets[index], imgOffsets[index + 1]
+                imgs[index] = pygame.image.fromstring(
+                    imgData[start:end].tobytes(), tuple(imgSizes[index]),
+                    imgFormat)
+
+            return imgs[index]
+
+        rows = points.shape[1]
+
+        def makeTile(i, j):
+            k = i * rows + j
+
+            tileImgRange = tileImgs[tileImgOffsets[k]:
+                                    tileImgOffsets[k + 1]].tolist()
+            tileTagRange = tileTags[tileTagOffsets[k]:
+                                    tileTagOffsets[k + 1]].tolist()
+
+            return Tile(points[i, j].tolist(), sizes[i, j].tolist(),
+                        tuple(colours[i, j].tolist()) if hasColour[i, j]
+                        else None,
+                        [getImg(index) for index in tileImgRange],
+                        [tags[index] for index in tileTagRange])
+
+        tiles = [LazyColumn(rows, lambda j, i = i : makeTile(i, j))
+                 for i in range(len(points))]
+
+        return Grid(surface, num, colour, tiles)
     
     def toSurface(self, drawGrid = False, gridColour = (0, 0, 0), gridSize = 1):
         s = pygame.Surface((self.x * self.tilesize[0], self.y * self.tilesize[1]))
@@ -2,9 +2,72 @@
 
 import pygame
 
+import shapes
+import spriteatlas
+
 COLOURKEY = (255, 0, 255)
 BLACK = (0, 0, 0)
 
+def normaliseColour(colour):
+    """Any colour pygame accepts, such as (255, 255, 255) or 0xFFFFFFFF,
+       as an RGBA tuple, or None for None"""
+
+    if colour is None:
+        return None
+
+    return tuple(pygame.Color(colour))
+
+class TextCache():
+    """Rendered text, kept so that text which has not changed since it
+       was last drawn need not be rendered again. Whole strings and
+       single characters (glyphs) are cached separately, the latter for
+       building up text a character at a time. Surfaces returned are
+       shared, so should not be drawn on. Colours may be anything
+       pygame.Color accepts."""
+    
+    def __init__(self, maxSize = 256, maxGlyphs = 1024):
+        self.text = spriteatlas.LRUCache(maxSize)
+        self.glyphs = spriteatlas.LRUCache(maxGlyphs)
+
+    def render(self, font, text, antialias, colour, background = None):
+        colour = normaliseColour(colour)
+        background = normaliseColour(background)
+
+        key = (font, text, antialias, colour, background)
+        img = self.text.get(key)
+
+        if img is None:
+            img = spriteatlas.convertToDisplay(font.render(text, antialias,
+                                                           colour, background))
+            self.text.put(key, img)
+
+        return img
+
+    def glyph(self, font, char, antialias, colour):
+        colour = normaliseColour(colour)
+
+        key = (font, char, antialias, colour)
+        img = self.glyphs.get(key)
+
+        if img is None:
+            img = spriteatlas.convertToDisplay(font.render(char, antialias,
+                                                           colour))
+            self.glyphs.put(key, img)
+
+        return img
+
+    def clear(self):
+        self.text.clear()
+        self.glyphs.clear()
+
+textCache = TextCache()
+
+def renderText(font, text, antialias, colour, background = None):
+    """Like font.render, but cached. The surface returned is shared with
+       the cache, so copy it before drawing on it."""
+    
+    return textCache.render(font, text, antialias, colour, background)
+
 def drawBrokenLine(colour, points, width = 1, surf=None):
     surface = surf if surf is not None else pygame.display.get_surface()
 
@@ -14,9 +77,21 @@ def drawBrokenLine(colour, points, width = 1, surf=None):
 
 
 def multiLineRender(font, string, antialias, colour):
-    colourkey = COLOURKEY if colour != COLOURKEY else BLACK
+    """Render text with a line for each newline in it. Like renderText,
+       the surface returned is shared with the cache, so copy it before
+       drawing on it."""
+
+    colour = normaliseColour(colour)
+
+    key = (font, string, antialias, colour, "multiline")
+    s = textCache.text.get(key)
+    
+    if s is not None:
+        return s
+    
+    colourkey = COLOURKEY if colour[:3] != COLOURKEY else BLACK
 
-    text = [font.render(line, antialias, colour, colourkey)
+    text = [renderText(font, line, antialias, colour, colourkey)
             for line in string.split("\n")]
 
     x = max((line.get_width()  for line in text))
@@ -32,6 +107,8 @@ def multiLineRender(font, string, antialias, colour):
         s.blit(line, (0, blit_y))
         blit_y += line.get_height()
 
+    textCache.text.put(key, s)
+
     return s
 
 
@@ -49,12 +126,16 @@ class InputBox():
         else:
             self.pos = pos
             self.central = False
-        self.colour = colour
+        self.colour = normaliseColour(colour)
         self.maxlen = maxlen
-        self.textImg = self.font.render(self.text, True, self.colour).convert_alpha()
+        
+        self.buffer = None #The text is drawn onto this a character at a
+        self.renderedText = "" #time, and textImg is the part of it
+        self.offsets = [0]     #holding renderedText. offsets[i] is the
+        self.renderText()      #width of its first i characters.
         
         alphabet = "abcdefghigklmnopqrstuvwxyz1234567890"
-        self.key2char = key2char if key2char != None else {eval("pygame.K_" + char) : char for char in alphabet}
+        self.key2char = key2char if key2char != None else {getattr(pygame, "K_" + char) : char for char in alphabet}
         self.key2upperchar = {i : j.upper() for i, j in self.key2char.items()}
         self.upperCase = False
         self.shift = False
@@ -62,6 +143,56 @@ class InputBox():
     def draw(self):
         self.surface.blit(self.textImg, self.pos)
 
+    def renderText(self):
+        """Update textImg to show our text, rendering only the
+           characters after the part which is unchanged"""
+
+        common = 0
+        
+        for old, new in zip(self.renderedText, self.text):
+            if old != new:
+                break
+            common += 1
+
+        del self.offsets[common + 1:] #Offsets of the unchanged part.
+        
+        for i in range(common, len(self.text)):
+            self.offsets.append(self.font.size(self.text[:i + 1])[0])
+
+        start = self.offsets[common]
+        width = self.offsets[-1]
+        height = self.font.get_height()
+
+        if self.buffer is None or width > self.buffer.get_width():
+            #Grow the buffer, doubling it so as to grow rarely.
+            
+            old = self.buffer
+            self.buffer = pygame.Surface((max(width, 16) * 2, height),
+                                         pygame.SRCALPHA)
+            self.buffer.fill(self.colour[:3] + (0,))
+            
+            if old is not None:
+                self.buffer.blit(old, (0, 0), (0, 0, start, height))
+                
+            self.buffer = spriteatlas.convertToDisplay(self.buffer)
+
+        #Clear the changed tail, then draw its new characters. As every
+        #character is the same colour, taking the greatest alpha where
+        #they overlap composes them exactly.
+        
+        self.buffer.fill(self.colour[:3] + (0,),
+                         (start, 0, self.buffer.get_width() - start, height))
+
+        for i in range(common, len(self.text)):
+            glyph = textCache.glyph(self.font, self.text[i], True,
+                                    self.colour)
+            
+            self.buffer.blit(glyph, (self.offsets[i], 0),
+                             special_flags = pygame.BLEND_RGBA_MAX)
+
+        self.renderedText = self.text
+        self.textImg = self.buffer.subsurface((0, 0, width, height))
+
     def recentralise(self):
         self.pos = (self.surface.get_width() / 2 - self.textImg.get_width() / 2,
                     self.surface.get_height() / 2 - self.textImg.get_height() / 2)
@@ -74,13 +205,13 @@ class InputBox():
                 else:
                     self.text += self.key2char[key]
 
-                self.textImg = self.font.render(self.text, True, self.colour).convert_alpha()
+                self.renderText()
                 if self.central:
                     self.recentralise()
 
             elif key == pygame.K_BACKSPACE:
                 self.text = self.text[:len(self.text) - 1]
-                self.textImg = self.font.render(self.text, True, self.colour).convert_alpha()
+                self.renderText()
                 if self.central:
                     self.recentralise()
             elif key == pygame.K_CAPSLOCK:
@@ -88,7 +219,7 @@ class InputBox():
 
             elif key == pygame.K_SPACE:
                 self.text += " "
-                self.textImg = self.font.render(self.text, True, self.colour).convert_alpha()
+                self.renderText()
                 if self.central:
                     self.recentralise()
 
@@ -136,16 +267,168 @@ class Button():
         self.mouseOver = self.checkMouseOver()
 
 class Cursor():
-    def __init__(self, img):
+    def __init__(self, img, manager = None):
         pygame.mouse.set_visible(False)
         
         self.img = img
         self.screen = pygame.display.get_surface()
+        self.surface = self.screen
+        self.manager = manager #A GUIManager tracking the mouse for us.
+        
     def draw(self):
-        pos = [pygame.mouse.get_pos()[i] - self.img.get_size()[i] / 2
+        if self.manager is not None:
+            mousePos = self.manager.mousePos
+        else:
+            mousePos = pygame.mouse.get_pos()
+            
+        pos = [mousePos[i] - self.img.get_size()[i] / 2
                for i in (0, 1)]
         
-        self.screen.blit(self.img, pos)
+        shapes.reportDraw(self, self.screen.blit(self.img, pos), None)
 
+class GUIManager():
+    """Keeps track of the mouse from events, rather than every widget
+       polling it every frame, and of which widgets have changed and so
+       need drawing again. Widgets are found under the mouse through a
+       spatial hash of their rects, so only those under it are looked
+       at however many there are.
+
+       Widgets are drawn onto surface and stay there until they change.
+       Given a game's background when dirty rendering, they are then
+       restored along with it rather than redrawn every frame."""
     
-    
+    def __init__(self, surface = None, cellSize = 64, mouseButton = 1):
+        self.surface = surface if surface is not None else pygame.display.get_surface()
+        self.cellSize = cellSize
+        self.mouseButton = mouseButton #The mouse button which clicks.
+        
+        self.widgets = []
+        self.cells = {} #Maps each cell to the widgets overlapping it.
+        self.underlays = {} #What was beneath each widget when first
+                            #drawn, and where.
+        self.changed = set()
+        
+        self.mousePos = (0, 0)
+        self.hovered = [] #Widgets under the mouse.
+        self.pressed = [] #Widgets the mouse button went down on.
+        
+    def getCells(self, rect):
+        left = rect.left // self.cellSize
+        top = rect.top // self.cellSize
+        right = (rect.right - 1) // self.cellSize
+        bottom = (rect.bottom - 1) // self.cellSize
+        
+        return [(x, y) for x in range(left, right + 1)
+                       for y in range(top, bottom + 1)]
+        
+    def add(self, widget):
+        """Manage a widget with a rect and a draw method, such as a
+           Button, which is then drawn onto our surface"""
+        
+        widget.surface = self.surface
+        self.widgets.append(widget)
+        
+        for cell in self.getCells(widget.rect):
+            self.cells.setdefault(cell, []).append(widget)
+            
+        self.changed.add(widget)
+        
+    def remove(self, widget):
+        self.widgets.remove(widget)
+        
+        for cell in self.getCells(widget.rect):
+            self.cells[cell].remove(widget)
+            
+        if widget in self.underlays:
+            self.surface.blit(*self.underlays.pop(widget))
+            
+        self.changed.discard(widget)
+        
+        if widget in self.hovered:
+            self.hovered.remove(widget)
+        if widget in self.pressed:
+            self.pressed.remove(widget)
+        
+    def widgetsAt(self, point):
+        cell = (int(point[0] // self.cellSize), int(point[1] // self.cellSize))
+        
+        return [widget for widget in self.cells.get(cell, ())
+                if widget.rect.collidepoint(point)]
+        
+    def handleEvent(self, event):
+        """Update widgets from a mouse event. Returns whether the event
+           was used by a widget, so need not be handled elsewhere."""
+        
+        if event.type == pygame.MOUSEMOTION:
+            self.mousePos = event.pos
+            hovered = self.widgetsAt(event.pos)
+            
+            for widget in self.hovered:
+                if widget not in hovered:
+                    widget.mouseOver = False
+                    self.changed.add(widget)
+                    
+            for widget in hovered:
+                if widget not in self.hovered:
+                    widget.mouseOver = True
+                    self.changed.add(widget)
+                    
+            self.hovered = hovered
+            
+        elif (event.type == pygame.MOUSEBUTTONDOWN and
+              event.button == self.mouseButton):
+            
+            self.mousePos = event.pos
+            self.pressed = self.widgetsAt(event.pos)
+            
+            for widget in self.pressed:
+                widget.clicked = not widget.clicked
+                widget.mouseDown = True
+                self.changed.add(widget)
+                
+            return bool(self.pressed)
+            
+        elif (event.type == pygame.MOUSEBUTTONUP and
+              event.button == self.mouseButton):
+            
+            for widget in self.pressed:
+                widget.mouseDown = False
+                
+            self.pressed = []
+            
+        return False
+        
+    def redrawAll(self):
+        self.changed.update(self.widgets)
+        
+    def draw(self):
+        """Draw the widgets which have changed since last drawn,
+           returning the rects drawn to"""
+        
+        rects = []
+        
+        for widget in self.widgets:
+            if widget not in self.changed:
+                continue
+            
+            if widget in self.underlays:
+                self.surface.blit(*self.underlays[widget])
+            else:
+                rect = self.surface.get_rect().clip(widget.rect)
+                self.underlays[widget] = (self.surface.subsurface(rect).copy(),
+                                          rect)
+                
+            widget.draw()
+            rects.append(widget.rect)
+            
+        self.changed.clear()
+        
+        return rects
+        
+    def drawAll(self):
+        """Draw every widget, for surfaces cleared each frame"""
+        
+        for widget in self.widgets:
+            widget.draw()
+            
+        self.changed.clear()
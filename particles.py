@@ -1,7 +1,14 @@
 import pygame
 import angle
+import shapes
 import random
 import math
+import functools
+import numpy
+
+defaultSurface = None #Surface particles are drawn to and kept within when
+                      #given none and there is no display, as when a
+                      #game.Game is headless. Set by game.Game.
 
 def shadeRange(start = (255, 255, 255), end = (0, 0, 0), step = 1):
     currentShade = start
@@ -48,8 +55,8 @@ class ParticleManager():
         self.emitters = self.__class__.emitters
         
     def update(self, deltaTime):
-        for particle in self.particles:
-            particle.update(deltaTime)
+        for particle in self.particles[:]: #Particles remove themselves
+            particle.update(deltaTime)     #as they die.
             
         for emitter in self.emitters:
             emitter.update()
@@ -59,7 +66,13 @@ class ParticleManager():
             particle.draw()
         
 
-class Particle():
+class CompactParticle():
+    """A particle holding its state in __slots__, to keep the memory
+       used by a great many of them down"""
+
+    __slots__ = ("pos", "velocity", "size", "colour", "lifespan",
+                 "timeAlive", "surface", "surfrect", "lastDrawn")
+    
     def __init__(self, pos, colour, velocity, lifespan = None, size = (1, 1), surface = None):
         
         self.pos = toVector2(pos)
@@ -73,11 +86,15 @@ class Particle():
         ParticleManager.particles.append(self)
         
         if surface is None:
-            self.surface = pygame.display.get_surface()
+            self.surface = pygame.display.get_surface() or defaultSurface
         else:
             self.surface = surface
-            
-        self.surfrect = self.surface.get_rect()
+
+        if self.surface is not None:
+            self.surfrect = self.surface.get_rect()
+        else:
+            self.surfrect = None #Without a surface there is nothing to
+                                 #leave, so only the lifespan ends us.
         
     def update(self, deltaTime):
         self.pos[0] += self.velocity[0] * deltaTime
@@ -85,15 +102,21 @@ class Particle():
         
         self.timeAlive += deltaTime
         
-        if not self.surfrect.collidepoint(self.pos) or (self.lifespan is not None and self.timeAlive >= self.lifespan):
+        if ((self.surfrect is not None and not self.surfrect.collidepoint(self.pos)) or
+            (self.lifespan is not None and self.timeAlive >= self.lifespan)):
             self.die()
         
     def draw(self):
-        self.surface.fill(self.colour, (self.pos, self.size))
+        shapes.reportDraw(self, self.surface.fill(self.colour,
+                                                  (self.pos, self.size)),
+                          self.colour)
             
     def die(self):
         ParticleManager.particles.remove(self)
         del(self)
+
+class Particle(CompactParticle):
+    """A CompactParticle which can be given other attributes"""
         
 class Emitter():
     def __init__(self, *args, **kwargs):
@@ -105,12 +128,36 @@ class Emitter():
     def update(self):
         Particle(*self.args, **self.kwargs)
         
+@functools.lru_cache(maxsize = 64)
+def directionTable(numParticles, minAngle = 0, maxAngle = 2 * math.pi):
+    """Unit vectors for numParticles angles evenly spaced from minAngle
+       up to maxAngle, as a read only array. Tables are cached, as
+       explosions and sparks spawn the same angles ring after ring."""
+    
+    #With no particles the table is empty, so any step will do.
+    step = (maxAngle - minAngle) / numParticles if numParticles else 0
+    table = angle.fromRadiansArray(minAngle + numpy.arange(numParticles) * step)
+    table.setflags(write = False)
+    
+    return table
+    
+def spawn(pos, colours, directions, speeds, lifespans, size, surface):
+    velocities = directions * numpy.array(speeds)[:, None]
+    
+    for colour, velocity, lifespan in zip(colours, velocities.tolist(), lifespans):
+        Particle(pos, colour, velocity, lifespan, size, surface)
+        
 def circle(pos, speed, colours, numParticles = 100, lifespan = None, size = (1, 1), surface = None, speedSigma = None, lifespanSigma = None):
+    speeds = []
+    lifespans = []
+    colours_ = []
+    
     for i in range(numParticles):
-        realSpeed = calcGaussIfSigma(speed, speedSigma)
-        realLifespan = calcGaussIfSigma(lifespan, lifespanSigma)
+        speeds.append(calcGaussIfSigma(speed, speedSigma))
+        lifespans.append(calcGaussIfSigma(lifespan, lifespanSigma))
+        colours_.append(pickColour(colours))
         
-        Particle(pos, pickColour(colours), angle.fromRadians((2 * math.pi) / numParticles * i) * realSpeed, realLifespan, size, surface)
+    spawn(pos, colours_, directionTable(numParticles), speeds, lifespans, size, surface)
         
 def explosion(pos, speed, colour, particlesPerCircle = 40, numCircles = 5, lifespan = None, size = (1, 1), surface = None, speedSigma = 20, lifespanSigma = 0.2):
     for i in range(numCircles):
@@ -123,18 +170,29 @@ def arc(pos, speed, colours, minAngle, maxAngle, numParticles = 40, lifespan = N
     if isinstance(maxAngle, pygame.math.Vector2):
         maxAngle = angle.toRadians(maxAngle)
         
+    speeds = []
+    colours_ = []
+    angles = []
+        
     for i in range(numParticles):
         realSpeed = abs(calcGaussIfSigma(speed, speedSigma))
         realLifespan = (calcGaussIfSigma(lifespan, lifespanSigma))
             
-        realColour = pickColour(colours)
+        speeds.append(realSpeed)
+        colours_.append(pickColour(colours))
         
         if randAngle:
-            _angle = random.uniform(minAngle, maxAngle)
-        else:
-            _angle = (maxAngle - minAngle) / numParticles * i
-        
-        Particle(pos, realColour, angle.fromRadians(_angle) * realSpeed, lifespan, size, surface)
+            angles.append(random.uniform(minAngle, maxAngle))
+            
+    #Random numbers are drawn in the same order as when each particle
+    #was made in turn, then the directions found all at once.
+    
+    if randAngle:
+        directions = angle.fromRadiansArray(angles)
+    else:
+        directions = directionTable(numParticles, minAngle, maxAngle)
+    
+    spawn(pos, colours_, directions, speeds, [lifespan] * numParticles, size, surface)
         
 def sparks(pos, speed, colour, minAngle, maxAngle, numArcs = 4, particlesPerArc = 20, lifespan = None, size = (1, 1), surface = None, speedSigma = 20, lifespanSigma = 0.2, randAngle = True):
     for i in range(numArcs):
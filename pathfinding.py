@@ -0,0 +1,281 @@
+#pathfinding.py
+
+#This file contains path queries over a grid.Grid. Tiles are walkable
+#unless they carry one of a set of blocking tags. Single paths are found
+#with A*, while many agents heading for the same tile can share one
+#flow field, computed once with Dijkstra's algorithm and cached until
+#any tile's tags change.
+
+import heapq
+import math
+from collections import OrderedDict
+
+import numpy
+import pygame
+
+from grid import CompactTile
+
+STRAIGHT = ((1, 0), (0, 1), (-1, 0), (0, -1))
+DIAGONAL = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+DIAGONAL_COST = math.sqrt(2)
+
+class FlowField():
+    """The cost of travelling from every tile to a target tile and the
+       direction to step in from each tile to get there"""
+
+    def __init__(self, grid, target, costs, directions):
+        self.grid = grid
+        self.target = target
+        self.costs = costs #(columns, rows) array, inf where unreachable.
+        self.directions = directions #(columns, rows, 2) unit vectors.
+
+    def inBounds(self, index):
+        return (0 <= index[0] < self.costs.shape[0] and
+                0 <= index[1] < self.costs.shape[1])
+
+    def getCost(self, index):
+        if not self.inBounds(index):
+            return math.inf
+
+        return float(self.costs[index])
+
+    def directionAt(self, index):
+        if not self.inBounds(index):
+            return pygame.math.Vector2(0, 0)
+
+        return pygame.math.Vector2(*self.directions[index])
+
+    def direction(self, point):
+        """The direction to move in from a point to follow the field"""
+
+        return self.directionAt(self.grid.pointIndex(point))
+
+    def directionsFor(self, points):
+        """Directions for an (n, 2) array of points, as an (n, 2) array.
+           Points outside the grid get a zero direction."""
+
+        points = numpy.asarray(points, numpy.float64).reshape(-1, 2)
+        indices = numpy.floor(points /
+                              numpy.array(self.grid.tilesize)).astype(int)
+
+        inside = ((indices >= 0).all(axis = 1) &
+                  (indices[:, 0] < self.costs.shape[0]) &
+                  (indices[:, 1] < self.costs.shape[1]))
+
+        result = numpy.zeros(points.shape)
+        result[inside] = self.directions[indices[inside, 0],
+                                         indices[inside, 1]]
+        return result
+
+class Pathfinder():
+    def __init__(self, grid, blockedTags = ("wall",), diagonal = True,
+                 cacheSize = 32):
+
+        self.grid = grid
+        self.blockedTags = set(blockedTags)
+        self.diagonal = diagonal
+        self.cacheSize = cacheSize #Maximum number of cached flow fields.
+
+        self.offsets = STRAIGHT + DIAGONAL if diagonal else STRAIGHT
+
+        self.flowFields = OrderedDict()
+        self.walkable = None
+        self.tagVersion = None
+
+    def invalidate(self):
+        """Discard cached walkability and flow fields. This happens
+           automatically when tags are changed through Tile's methods,
+           but must be called if tags are changed some other way."""
+
+        self.walkable = None
+        self.tagVersion = None
+        self.flowFields.clear()
+
+    def getWalkable(self):
+        """The (columns, rows) boolean walkability mask of the grid"""
+
+        if self.walkable is None or self.tagVersion != CompactTile.tagVersion:
+            self.flowFields.clear()
+            self.tagVersion = CompactTile.tagVersion
+
+            self.walkable = numpy.array(
+                [[self.blockedTags.isdisjoint(tile.tags) for tile in column]
+                 for column in self.grid.tiles], numpy.bool_)
+
+        return self.walkable
+
+    def toIndex(self, tile):
+        if isinstance(tile, CompactTile):
+            return self.grid.tileIndex(tile)
+
+        return tuple(tile)
+
+    def isWalkable(self, index):
+        walkable = self.getWalkable()
+
+        return (0 <= index[0] < walkable.shape[0] and
+                0 <= index[1] < walkable.shape[1] and
+                bool(walkable[index]))
+
+    def neighbours(self, index, walkable = None):
+        """Walkable neighbours of a tile index with the cost of moving
+           to each. Diagonal moves may not cut corners."""
+
+        if walkable is None:
+            walkable = self.getWalkable().tolist()
+
+        columns = len(walkable)
+        rows = len(walkable[0])
+        i, j = index
+
+        for di, dj in self.offsets:
+            ni = i + di
+            nj = j + dj
+
+            if not (0 <= ni < columns and 0 <= nj < rows and
+                    walkable[ni][nj]):
+                continue
+
+            if di and dj:
+                if not (walkable[ni][j] and walkable[i][nj]):
+                    continue
+
+                yield (ni, nj), DIAGONAL_COST
+            else:
+                yield (ni, nj), 1
+
+    def heuristic(self, a, b):
+        dx = abs(a[0] - b[0])
+        dy = abs(a[1] - b[1])
+
+        if self.diagonal:
+            #Octile distance.
+            return max(dx, dy) + (DIAGONAL_COST - 1) * min(dx, dy)
+
+        return dx + dy
+
+    def findPath(self, start, goal):
+        """Find the shortest path between two tiles (or tile indices)
+           with A*. Returns the list of tiles from start to goal
+           inclusive, or None if the goal cannot be reached."""
+
+        start = self.toIndex(start)
+        goal = self.toIndex(goal)
+
+        if not (self.isWalkable(start) and self.isWalkable(goal)):
+            return None
+
+        walkable = self.getWalkable().tolist()
+
+        openHeap = [(self.heuristic(start, goal), 0, start)]
+        cameFrom = {start : None}
+        costs = {start : 0}
+
+        while openHeap:
+            estimate, cost, current = heapq.heappop(openHeap)
+
+            if current == goal:
+                path = []
+
+                while current is not None:
+                    path.append(self.grid[current[0]][current[1]])
+                    current = cameFrom[current]
+
+                path.reverse()
+                return path
+
+            if cost > costs[current]:
+                continue #A cheaper route here was already expanded.
+
+            for neighbour, stepCost in self.neighbours(current, walkable):
+                newCost = cost + stepCost
+
+                if newCost < costs.get(neighbour, math.inf):
+                    costs[neighbour] = newCost
+                    cameFrom[neighbour] = current
+                    heapq.heappush(openHeap,
+                                   (newCost +
+                                    self.heuristic(neighbour, goal),
+                                    newCost, neighbour))
+
+        return None
+
+    def flowField(self, target):
+        """Get the flow field towards a tile (or tile index), computing
+           it only if it is not already cached"""
+
+        target = self.toIndex(target)
+        walkable = self.getWalkable() #Clears the cache if tags changed.
+
+        if target in self.flowFields:
+            self.flowFields.move_to_end(target)
+            return self.flowFields[target]
+
+        #Python lists are faster than arrays to index one at a time.
+        walkableList = walkable.tolist()
+        costs = numpy.full(walkable.shape, numpy.inf)
+        best = costs.tolist()
+
+        if self.isWalkable(target):
+            best[target[0]][target[1]] = 0
+            heap = [(0, target)]
+
+            while heap:
+                cost, current = heapq.heappop(heap)
+
+                if cost > best[current[0]][current[1]]:
+                    continue
+
+                for neighbour, stepCost in self.neighbours(current,
+                                                           walkableList):
+                    newCost = cost + stepCost
+
+                    if newCost < best[neighbour[0]][neighbour[1]]:
+                        best[neighbour[0]][neighbour[1]] = newCost
+                        heapq.heappush(heap, (newCost, neighbour))
+
+            costs = numpy.array(best)
+
+        field = FlowField(self.grid, target, costs,
+                          self.calcDirections(costs, walkable))
+
+        self.flowFields[target] = field
+
+        if len(self.flowFields) > self.cacheSize:
+            self.flowFields.popitem(last = False)
+
+        return field
+
+    def calcDirections(self, costs, walkable):
+        """Point every tile towards its cheapest neighbour"""
+
+        columns, rows = costs.shape
+
+        padded = numpy.full((columns + 2, rows + 2), numpy.inf)
+        padded[1:-1, 1:-1] = costs
+
+        paddedWalkable = numpy.zeros((columns + 2, rows + 2), numpy.bool_)
+        paddedWalkable[1:-1, 1:-1] = walkable
+
+        def shifted(array, di, dj):
+            return array[1 + di : 1 + di + columns, 1 + dj : 1 + dj + rows]
+
+        best = costs.copy()
+        directions = numpy.zeros((columns, rows, 2))
+
+        for di, dj in self.offsets:
+            neighbourCosts = shifted(padded, di, dj)
+
+            if di and dj:
+                neighbourCosts = numpy.where(
+                    shifted(paddedWalkable, di, 0) &
+                    shifted(paddedWalkable, 0, dj),
+                    neighbourCosts, numpy.inf)
+
+            better = neighbourCosts < best
+            best[better] = neighbourCosts[better]
+            directions[better] = (numpy.array((di, dj)) /
+                                  math.hypot(di, dj))
+
+        directions[~walkable] = 0
+        return directions
@@ -26,12 +26,270 @@ from threading import Thread #To run some code in a thread is to run it
                              #physicsManager in another thread than
                              #the main one.
 
+from threading import Lock #Locks stop two threads from accessing the
+                           #same data at once.
+
+import numpy #Used to store the state of every object in one array.
+import quadtree #Keeps immobile objects, to find those in an area.
+from itertools import chain
+
+from collections import namedtuple
+from contextlib import nullcontext
+from types import MappingProxyType
+import time
+import warnings
+
+class ContactCache():
+    """The pairs of objects in contact, kept from one frame to the next
+       so that each frame's contacts can be sorted into those which
+       began, stayed or ended. Pairs are keyed by their collider ids."""
+
+    def __init__(self):
+        self.contacts = {} #Last frame's contacts.
+        self.current = {} #This frame's contacts so far.
+
+    def key(self, a, b):
+        ids = (a.collider.id, b.collider.id)
+        return ids if ids[0] <= ids[1] else ids[::-1]
+
+    def add(self, a, b, axis, data = None):
+        """Record a contact this frame, with any data to keep for next
+           frame, such as the impulse solver's accumulated impulses"""
+
+        key = self.key(a, b)
+
+        if key not in self.current:
+            self.current[key] = (a, b, axis, data)
+
+    def previous(self, a, b):
+        """Last frame's contact between two objects, if there was one"""
+
+        return self.contacts.get(self.key(a, b))
+
+    def touching(self, a, b):
+        return self.key(a, b) in self.contacts
+
+    def discard(self, object_):
+        """Forget an object's contacts, ending them next flush"""
+
+        self.current = {key : contact
+                        for key, contact in self.current.items()
+                        if object_ not in contact[:2]}
+
+    def flush(self):
+        """End the frame, returning a list of (event, a, b, axis) where
+           event is "begin", "stay" or "end"."""
+
+        events = [("end",) + contact[:3]
+                  for key, contact in self.contacts.items()
+                  if key not in self.current]
+
+        for key, contact in self.current.items():
+            events.append(("stay" if key in self.contacts else "begin",)
+                          + contact[:3])
+
+        self.contacts = self.current
+        self.current = {}
+
+        return events
+
+NOT_PROFILING = nullcontext() #Used for every phase when not profiling. It
+                              #holds no state, so one is enough, rather
+                              #than making one per object per phase.
+
+ALL_LAYERS = 0xFFFFFFFF #A collision mask which collides with every
+                        #layer.
+
+FrameState = namedtuple("FrameState", ("frame", "time", "positions",
+                                       "velocities"))
+#An immutable record of every object's position and velocity after one
+#physics frame, keyed by id(object_). When the physics manager runs in
+#its own thread, it publishes one of these after each frame for the
+#rendering thread to read, so that rendering never sees objects half
+#way through being updated.
+
+QueryHit = namedtuple("QueryHit", ("object", "distance", "point", "normal"))
+#What a query of the world found: the object, how far away it is, the
+#point where it was found and the surface normal there.
+
+SNAPSHOT_COLUMNS = 14 #Collider position, velocity, acceleration,
+                      #position, kinematic and immobile flags, force and
+                      #last acceleration (nan if None).
+
 def vectorElementMultiply(a, b):
     return pygame.math.Vector2([elA * elB for elA, elB in zip(a, b)])
 
+def orderedPosition(objects, managerIndex):
+    """Find where an object with a managerIndex belongs in a list of
+       objects kept in order of managerIndex"""
+
+    low = 0
+    high = len(objects)
+
+    while low < high:
+        middle = (low + high) // 2
+
+        if objects[middle].managerIndex < managerIndex:
+            low = middle + 1
+        else:
+            high = middle
+
+    return low
+
+def colliderBounds(objects):
+    """The bounds of objects' colliders as an array of rows of (left,
+       top, right, bottom), and an array of which of them are circles"""
+
+    bounds = numpy.array([quadtree.boundsOf(object_.collider)
+                          for object_ in objects], numpy.float64)
+    circles = numpy.array([isinstance(object_.collider, shapes.CompactCircle)
+                           for object_ in objects], bool)
+
+    return bounds.reshape(-1, 4), circles
+
+def overlappingPairs(a, b):
+    """The indices of each pair of bounds, one from the array a and one
+       from the array b, which overlap or touch, ordered by the first"""
+
+    return numpy.nonzero((a[:, None, 0] <= b[:, 2]) &
+                         (b[:, 0] <= a[:, None, 2]) &
+                         (a[:, None, 1] <= b[:, 3]) &
+                         (b[:, 1] <= a[:, None, 3]))
+
+def colliderShapes(colliders):
+    """Rows of each collider's unrounded centre and half size, then the
+       (left, top, right, bottom) it collides by, which is a Rect's
+       rounded pygame rect, and an array of which of them are circles"""
+
+    rows = []
+
+    for collider in colliders:
+        if isinstance(collider, shapes.CompactCircle):
+            x, y = collider.centre
+            r = collider.radius
+
+            rows.append((x, y, r, r, x - r, y - r, x + r, y + r))
+        else:
+            halfWidth = collider.width / 2
+            halfHeight = collider.height / 2
+
+            rows.append((collider.float_x + halfWidth,
+                         collider.float_y + halfHeight, halfWidth,
+                         halfHeight, collider.left, collider.top,
+                         collider.right, collider.bottom))
+
+    circles = numpy.array([isinstance(collider, shapes.CompactCircle)
+                           for collider in colliders], bool)
+
+    return numpy.array(rows, numpy.float64).reshape(-1, 8), circles
+
+def rayCircles(origins, motions, centres, radii):
+    """Like shapes.rayCircle for rows of rays and circles, returning the
+       fraction of each motion travelled, inf where the ray doesn't meet
+       its circle, and the normal where it does"""
+
+    with numpy.errstate(divide = "ignore", invalid = "ignore"):
+        offsets = origins - centres
+        a = (motions ** 2).sum(1)
+        b = 2 * (offsets * motions).sum(1)
+        c = (offsets ** 2).sum(1) - radii ** 2
+
+        discriminant = b ** 2 - 4 * a * c
+        t = (-b - numpy.sqrt(discriminant)) / (2 * a)
+
+        hits = (a > 0) & (c > 0) & (discriminant >= 0) & (t >= 0) & (t <= 1)
+
+        normals = origins + motions * t[:, None] - centres
+        lengths = numpy.hypot(normals[:, 0], normals[:, 1])
+        normals /= lengths[:, None]
+
+    normals[~hits | (lengths == 0)] = 0
+
+    return numpy.where(hits, t, numpy.inf), normals
+
+def rayRects(origins, motions, bounds):
+    """Like shapes.rayRect for rows of rays and rects, returning the
+       fraction of each motion travelled, inf where the ray doesn't
+       enter its rect, and the normal of the side it enters by"""
+
+    enter = numpy.full(len(origins), -numpy.inf)
+    exit_ = numpy.full(len(origins), numpy.inf)
+    enterAxis = numpy.zeros(len(origins), int)
+
+    with numpy.errstate(divide = "ignore", invalid = "ignore"):
+        for axis in (0, 1):
+            low = bounds[:, axis]
+            high = bounds[:, axis + 2]
+
+            t1 = (low - origins[:, axis]) / motions[:, axis]
+            t2 = (high - origins[:, axis]) / motions[:, axis]
+
+            #Rays not moving along this axis are either always or never
+            #between its sides.
+
+            between = (low < origins[:, axis]) & (origins[:, axis] < high)
+            still = motions[:, axis] == 0
+
+            near = numpy.where(still, numpy.where(between, -numpy.inf,
+                                                  numpy.inf),
+                               numpy.minimum(t1, t2))
+            far = numpy.where(still, numpy.where(between, numpy.inf,
+                                                 -numpy.inf),
+                              numpy.maximum(t1, t2))
+
+            enterAxis[near > enter] = axis
+            enter = numpy.maximum(enter, near)
+            exit_ = numpy.minimum(exit_, far)
+
+    hits = (enter <= exit_) & (enter >= 0) & (enter <= 1)
+    normals = numpy.zeros((len(origins), 2))
+
+    for axis in (0, 1):
+        entered = hits & (enterAxis == axis)
+        normals[entered, axis] = -numpy.sign(motions[entered, axis])
+
+    return numpy.where(hits, enter, numpy.inf), normals
+
+def sweepCirclesRects(centres, motions, radii, rects):
+    """Like shapes.CompactCircle.sweep for rows of circles moving
+       against rects given as (left, top, right, bottom)"""
+
+    left, top, right, bottom = rects.T
+    grownX = numpy.column_stack((left - radii, top, right + radii, bottom))
+    grownY = numpy.column_stack((left, top - radii, right, bottom + radii))
+
+    #The rect grown by the radius has rounded corners, so is the union of
+    #it grown in x, grown in y, and a circle at each corner.
+
+    hits = [rayRects(centres, motions, grownX),
+            rayRects(centres, motions, grownY)]
+
+    for x, y in ((left, top), (right, top), (left, bottom),
+                 (right, bottom)):
+        hits.append(rayCircles(centres, motions, numpy.column_stack((x, y)),
+                               radii))
+
+    times = numpy.array([hit[0] for hit in hits])
+    normals = numpy.array([hit[1] for hit in hits])
+
+    first = times.argmin(0)
+    pairs = numpy.arange(len(centres))
+
+    times = times[first, pairs]
+    normals = normals[first, pairs]
+
+    #Circles already overlapping their rects don't touch them.
+
+    closest = numpy.clip(centres, rects[:, :2], rects[:, 2:])
+    overlapping = ((centres - closest) ** 2).sum(1) < radii ** 2
+
+    times[overlapping] = numpy.inf
+
+    return times, normals
+
 class PhysicsManager(Thread):
-    _instance = None
-    _objects = []
+    _instance = None #The current world, which new PhysicsObjects join
+                     #unless given another.
     
     #def __new__(cls, *args, **kwargs):
         #Singleton class
@@ -46,17 +304,22 @@ class PhysicsManager(Thread):
         
     def __init__(self, pixelsPerMetre=10, gMagnitude=9.81,
                  gDirection=angle.DOWN, updateFunc=None,
-                 timeScale=1, resistance = (-0, -0)):
+                 timeScale=1, resistance = (-0, -0), tickRate=120,
+                 makeCurrent=True, ccdThreshold=0.5, solver="legacy",
+                 solverIterations=8, batchCollisionEvents=False,
+                 staticTreeThreshold=64, integrator="euler"):
 
-        PhysicsManager._instance = self
+        if makeCurrent:
+            PhysicsManager._instance = self
 
         Thread.__init__(self)
         self.daemon = True #Daemon threads do not keep the program open
                            #while all non-daemon threads have been 
                            #closed.
         
-        self.objects = self.__class__._objects 
-        #PhysicsObjects of which this manager is keeping track.
+        self.objects = [] #PhysicsObjects of which this manager is
+                          #keeping track. Each manager is a separate
+                          #world.
         
         self.clock = pygame.time.Clock() #Clock for time management.
         
@@ -80,15 +343,215 @@ class PhysicsManager(Thread):
 
         self.dt = 0 #Delta Time. the change in time since the last frame
                     #in seconds.
+
+        self.tickRate = tickRate #Maximum updates per second when
+                                 #running in a thread of its own.
+
+        self.ccdThreshold = ccdThreshold #Objects using continuous
+                                         #collision detection only do so
+                                         #when moving further than this
+                                         #fraction of their radius in a
+                                         #frame.
+
+        self.frameLock = Lock()
+        self.frames = [None, None] #Front and back frame states. The
+                                   #physics thread fills the back while
+                                   #renderers read the front.
+        self.renderFrame = None #The frame state currently being drawn.
+
+        self.profiler = None #A profiler.Profiler timing the phases of
+                             #each update, if profiling.
+
+        self.contactCache = ContactCache()
+        self.collisionEvents = [] #Last frame's begin, stay and end
+                                  #events.
+
+        self.batchCollisionEvents = batchCollisionEvents
+        #Whether onOwnCollision and onOtherCollision are called together
+        #after each update, rather than as objects collide.
+
+        self.pendingCollisions = []
+
+        self.stepping = False #Whether objects are being updated, during
+        self.removals = []    #which removals wait in removals.
+
+        self.staticTreeThreshold = staticTreeThreshold
+        #With at least this many immobile objects, they are kept in a
+        #quadtree so that the broadphase need only look at those nearby.
+
+        self.staticTree = None
+        self.staticObjects = None
+        self.dynamicObjects = None #Objects which aren't immobile, or
+                                   #None if they must be found again.
+
+        self.dynamicBounds = None #shapes.Shape.positionVersion and an
+                                  #array of the bounds of dynamicObjects'
+                                  #colliders then, for queries.
+
+        if integrator not in ("euler", "semi-implicit", "verlet"):
+            raise ValueError("Integrator must be \"euler\", "
+                             "\"semi-implicit\" or \"verlet\"")
+
+        self.integrator = integrator
+        #How forces move objects. "euler" keeps each solver's own order:
+        #the legacy solver moves objects by their velocities and then
+        #changes them, which is explicit Euler, and the impulse solver
+        #changes them first. "semi-implicit" is semi-implicit Euler with
+        #either solver, in which velocities change before objects move by
+        #them, which is steadier. "verlet" is velocity Verlet, which moves
+        #objects by their acceleration as well and so follows curved
+        #paths more accurately.
+
+        if solver == "impulse":
+            import solver as solver_
+
+            self.solver = solver_.ImpulseSolver(self, solverIterations)
+            #Resolves all contacts together with impulses, rather than
+            #each object pushing and bouncing off what it hits.
+
+        elif solver == "legacy":
+            self.solver = None
+        else:
+            raise ValueError("Solver must be \"legacy\" or \"impulse\"")
         
+    def makeCurrent(self):
+        """Make this the world which new PhysicsObjects join"""
+
+        PhysicsManager._instance = self
+
+    def add(self, object_):
+        """Start simulating an object in this world"""
+
+        object_.managerIndex = len(self.objects) #Our place in objects.
+        self.objects.append(object_)
+        object_.physicsManager = self
+
+        if self.dynamicObjects is None:
+            return #Found again when next looked for.
+
+        if not object_.immobile:
+            self.dynamicObjects.append(object_) #It comes last in order.
+            self.dynamicBounds = None
+        elif self.staticTree is not None:
+            self.staticObjects.append(object_)
+            self.staticTree.insert(object_)
+        else:
+            self.staticObjects.append(object_)
+
+            if len(self.staticObjects) >= self.staticTreeThreshold:
+                self.invalidateBounds() #Time to build the tree.
+
+    def remove(self, object_):
+        """Stop simulating an object. The last object takes its place in
+           objects, so that removal takes constant time. Objects removed
+           during an update are removed at the end of it."""
+
+        if object_.managerIndex is None:
+            return #Already removed.
+
+        if self.stepping:
+            if object_ not in self.removals:
+                self.removals.append(object_)
+            return
+
+        last = self.objects.pop()
+
+        self.unlist(object_)
+
+        if (object_.immobile and self.dynamicObjects is not None and
+            self.staticTree is not None):
+            self.staticTree.remove(object_)
+
+        if last is not object_:
+            self.unlist(last) #It moves up, so its place changes.
+            self.objects[object_.managerIndex] = last
+            last.managerIndex = object_.managerIndex
+            self.enlist(last)
+
+        object_.managerIndex = None
+
+        #Its contacts end next flush, so it and what it touched get end
+        #events.
+        self.contactCache.discard(object_)
+
+    def unlist(self, object_):
+        """Take an object out of the immobile or other objects, each kept
+           in order of managerIndex"""
+
+        if self.dynamicObjects is None:
+            return #Lost track, so all are found again anyway.
+
+        objects = (self.staticObjects if object_.immobile
+                   else self.dynamicObjects)
+        position = orderedPosition(objects, object_.managerIndex)
+
+        if position < len(objects) and objects[position] is object_:
+            del objects[position]
+
+            if not object_.immobile:
+                self.dynamicBounds = None
+        else:
+            self.invalidateBounds() #Made immobile or mobile since.
+
+    def enlist(self, object_):
+        """Put an object back among the immobile or other objects"""
+
+        if self.dynamicObjects is None:
+            return #Lost track, so all are found again anyway.
+
+        objects = (self.staticObjects if object_.immobile
+                   else self.dynamicObjects)
+        objects.insert(orderedPosition(objects, object_.managerIndex),
+                       object_)
+
+        if not object_.immobile:
+            self.dynamicBounds = None
+
+    def removePending(self):
+        removals = self.removals
+        self.removals = []
+
+        for object_ in removals:
+            self.remove(object_)
+
+    def profile(self, name):
+        """Time a with block as a phase of the update, if profiling"""
+
+        if self.profiler is None:
+            return NOT_PROFILING
+
+        return self.profiler.phase(name)
+
     def update(self, deltaTime):
         """Update the physics for this frame"""
         
-        self.dt = self.clock.tick() * self.timeScale / 1000 
-        #Divide by 1000 to convert milliseconds to seconds.
+        self.dt = deltaTime #Taken from the caller rather than our own
+                            #clock, so that the simulation depends only
+                            #on the times it is given.
         
-        for object_ in self.objects:
-            object_.physicsUpdate(deltaTime) #Update our objects.
+        self.stepping = True
+
+        try:
+            if self.solver is not None:
+                self.solver.step(deltaTime)
+            else:
+                semiImplicit = self.integrator == "semi-implicit"
+
+                if semiImplicit:
+                    with self.profile("integration"):
+                        self.integrateForces(self.objects, deltaTime)
+
+                for object_ in self.objects:
+                    object_.physicsUpdate(deltaTime) #Update our objects.
+
+                if not semiImplicit:
+                    with self.profile("integration"):
+                        self.integrateForces(self.objects, deltaTime)
+        finally:
+            self.stepping = False
+
+        self.removePending()
+        self.deliverCollisions()
 
         if self.updateFunc is not None:
             self.updateFunc() #If we have been passed an external
@@ -97,33 +560,263 @@ class PhysicsManager(Thread):
             
         self.frameCount += 1
         
+    def reportCollision(self, object_, hit):
+        """Record an object's collisions, calling its collision hooks
+           now or, if batching, after the update"""
+
+        for axis in (0, 1):
+            for other in hit[axis]:
+                self.contactCache.add(object_, other, axis)
+
+        if self.batchCollisionEvents:
+            self.pendingCollisions.append((object_, hit))
+        else:
+            self.callCollisionHooks(object_, hit)
+
+    def callCollisionHooks(self, object_, hit):
+        object_.onOwnCollision(hit)
+
+        for other in hit[0]:
+            other.onOtherCollision(object_, 0)
+
+        for other in hit[1]:
+            other.onOtherCollision(object_, 1)
+
+    def deliverCollisions(self):
+        """Call the batched collision hooks and the hooks for contacts
+           which began, stayed or ended this frame"""
+
+        pending = self.pendingCollisions
+        self.pendingCollisions = []
+
+        for object_, hit in pending:
+            self.callCollisionHooks(object_, hit)
+
+        self.collisionEvents = self.contactCache.flush()
+
+        for event, a, b, axis in self.collisionEvents:
+            hook = "onCollision" + event.capitalize()
+
+            getattr(a, hook)(b, axis)
+            getattr(b, hook)(a, axis)
+
     def applyResistance(self, object_, dt):
-        """Apply resistance from air, friction, etc."""
-        
-        r = pygame.math.Vector2(self.resistance) #Copy resistance so as
-                                                 #to not change it
-                                                 #overall while changing
-                                                 #it to apply to this
-                                                 #particular object.
-        
-        if object_.velocity[0] < 0:
-            r[0] *= -1
-        if object_.velocity[0] == 0:
-            r[0] = 0 
-        if object_.velocity[1] < 0:
-            r[1] *= -1
-        if object_.velocity[1] == 0:
-            r[1] = 0
-            
-        object_.applyForce(r * object_.velocity.length_squared() * dt)
-        #Resistance scales with the squared magnitude of the velocity.
-         
-    def collisionCheck(self, collider):
+        """Deprecated. Resistance is now applied to every object as its
+           forces are integrated, so this does nothing."""
+
+        warnings.warn("applyResistance is deprecated, as resistance is "
+                      "applied by integrateForces", DeprecationWarning,
+                      stacklevel = 2)
+
+    def calcResistance(self, velocities, dt):
+        """The resistance forces on objects moving at velocities"""
+
+        speedsSquared = (velocities ** 2).sum(-1, keepdims = True)
+
+        #Resistance scales with the squared magnitude of the velocity,
+        #and its sign is flipped on each axis to oppose the motion.
+
+        return (numpy.array(self.resistance) * numpy.sign(velocities) *
+                speedsSquared * dt)
+
+    def forceState(self, objects):
+        """The objects which forces move, and an array of rows of their
+           velocity, applied force, acceleration and mass. Forces applied
+           to the others are cleared."""
+
+        dynamic = []
+
+        for object_ in objects:
+            if not (object_.kinematic or object_.immobile):
+                dynamic.append(object_)
+            elif object_.force:
+                object_.force = pygame.math.Vector2()
+
+        state = numpy.fromiter(chain.from_iterable(
+            (*object_.velocity, *object_.force, *object_.acceleration,
+             object_.mass) for object_ in dynamic), numpy.float64,
+                               len(dynamic) * 7).reshape(-1, 7)
+
+        return dynamic, state
+
+    def calcAccelerations(self, state, dt):
+        """The accelerations, besides those from applied forces, of
+           objects with the state given by forceState"""
+
+        return (state[:, 4:6] + numpy.array(self.g) +
+                self.calcResistance(state[:, 0:2], dt) / state[:, 6:7])
+
+    def integrateForces(self, objects, dt):
+        """Change the velocities of objects by gravity, their own
+           accelerations, the forces applied to them and resistance, all
+           at once, then clear the forces"""
+
+        dynamic, state = self.forceState(objects)
+
+        if not dynamic:
+            return
+
+        velocities = state[:, 0:2]
+        masses = state[:, 6:7]
+
+        accelerations = self.calcAccelerations(state, dt)
+
+        velocities += state[:, 2:4] / masses * dt #Applied forces act only
+                                                  #for this frame.
+
+        if self.integrator == "verlet":
+            last = numpy.array([(numpy.nan, numpy.nan)
+                                if object_.lastAcceleration is None else
+                                tuple(object_.lastAcceleration)
+                                for object_ in dynamic], numpy.float64)
+
+            #New objects have no acceleration from last frame, so take
+            #this frame's.
+
+            last = numpy.where(numpy.isnan(last), accelerations, last)
+
+            if self.solver is not None:
+                #The impulse solver solves contacts before moving
+                #objects, so the frame is split: half of the acceleration
+                #at the start now, and half of that at the end once
+                #objects have moved, by finishVerletStep.
+
+                velocities += last * (dt / 2)
+            else:
+                #Objects have already moved by their velocities and half
+                #the acceleration at the start, so take the average of
+                #the accelerations at the start and end of the frame.
+
+                velocities += (last + accelerations) / 2 * dt
+
+                for object_, acceleration in zip(dynamic,
+                                                 accelerations.tolist()):
+                    object_.lastAcceleration = pygame.math.Vector2(
+                        acceleration)
+        else:
+            velocities += accelerations * dt
+
+        for object_, velocity in zip(dynamic, velocities.tolist()):
+            object_.velocity[:] = velocity
+
+            if object_.force:
+                object_.force = pygame.math.Vector2()
+
+    def finishVerletStep(self, objects, dt):
+        """Give objects the second half of the frame's acceleration, as
+           found where they are now, after the impulse solver has moved
+           them by their velocities"""
+
+        dynamic, state = self.forceState(objects)
+
+        if not dynamic:
+            return
+
+        accelerations = self.calcAccelerations(state, dt)
+        velocities = state[:, 0:2] + accelerations * (dt / 2)
+
+        for object_, velocity, acceleration in zip(dynamic,
+                                                   velocities.tolist(),
+                                                   accelerations.tolist()):
+            object_.velocity[:] = velocity
+            object_.lastAcceleration = pygame.math.Vector2(acceleration)
+
+    def invalidateBounds(self):
+        """Find where objects are again before they are next looked for.
+           Call if an immobile object is moved, or if another object's
+           collider is moved other than by move_ip or setPos and then
+           queried for."""
+
+        self.dynamicObjects = None
+        self.dynamicBounds = None
+
+    def updateStatic(self):
+        if self.dynamicObjects is not None:
+            return
+
+        static = [object_ for object_ in self.objects if object_.immobile]
+
+        self.staticObjects = static
+        self.dynamicObjects = [object_ for object_ in self.objects
+                               if not object_.immobile]
+
+        if len(static) < self.staticTreeThreshold:
+            self.staticTree = None
+            return
+
+        getBounds = lambda object_ : quadtree.boundsOf(object_.collider)
+        bounds = numpy.array([getBounds(object_) for object_ in static])
+
+        self.staticTree = quadtree.QuadTree((bounds[:, 0].min(),
+                                             bounds[:, 1].min(),
+                                             bounds[:, 2].max(),
+                                             bounds[:, 3].max()),
+                                            getBounds = getBounds)
+        self.staticTree.build(static)
+
+    def broadphase(self, collider, owner = None, bounds = None):
+        """Find the objects which a collider could be colliding with. If
+           the object owning the collider is given, objects it cannot
+           collide with are left out: those not matching its layer and
+           mask, and other immobile objects if it is immobile. Immobile
+           objects are looked for within bounds, as (left, top, right,
+           bottom), if given, rather than the collider's bounds."""
+
+        self.updateStatic()
+
+        if self.staticTree is None:
+            objects = self.objects
+            near = ()
+        elif owner is not None and owner.immobile:
+            objects = self.dynamicObjects
+            near = ()
+        else:
+            #Immobile objects are only looked at if they're near.
+
+            if bounds is None:
+                bounds = quadtree.boundsOf(collider)
+
+            objects = self.dynamicObjects
+            near = sorted(self.staticTree.queryBounds(bounds),
+                          key = lambda object_ : object_.managerIndex)
+
+        if owner is None:
+            candidates = lambda objects : [
+                object_ for object_ in objects
+                if collider.id != object_.collider.id]
+        else:
+            immobile = owner.immobile
+            layer = owner.collisionLayer
+            mask = owner.collisionMask
+
+            candidates = lambda objects : [
+                object_ for object_ in objects
+                if collider.id != object_.collider.id and
+                not (immobile and object_.immobile) and
+                layer & object_.collisionMask and
+                object_.collisionLayer & mask]
+
+        found = candidates(objects)
+
+        #Those near are put among the others in the order of objects, as
+        #they would be without the tree, so what is found first is the
+        #same either way.
+
+        for object_ in candidates(near):
+            found.insert(orderedPosition(found, object_.managerIndex),
+                         object_)
+
+        return found
+
+    def collisionCheck(self, collider, owner = None):
         """Check if an object is colliding with any other objects"""
-        
-        return [object_ for object_ in self.objects
-                if collider.collide(object_.collider)
-                and collider.id != object_.collider.id]
+
+        with self.profile("broadphase"):
+            candidates = self.broadphase(collider, owner)
+
+        with self.profile("narrowphase"):
+            return [object_ for object_ in candidates
+                    if collider.collide(object_.collider)]
 
         #collider.id is unique for each enique collider, but is shared
         #between copies of the same collider. (when the copy method of
@@ -133,6 +826,392 @@ class PhysicsManager(Thread):
         #copies must be moved before the actual collider can be moved, 
         #to check whether this movement would result in collision.
     
+    def sweep(self, collider, motion, owner = None):
+        """Find the first object a collider would touch if moved by
+           motion. Returns the fraction of the motion travelled before
+           touching, the surface normal there and the object touched,
+           or None if nothing would be touched."""
+
+        first = None
+
+        #Look for immobile objects along the whole path, not just where
+        #the collider starts.
+
+        left, top, right, bottom = quadtree.boundsOf(collider)
+        bounds = (left + min(motion[0], 0), top + min(motion[1], 0),
+                  right + max(motion[0], 0), bottom + max(motion[1], 0))
+
+        for object_ in self.broadphase(collider, owner, bounds):
+            hit = collider.sweep(motion, object_.collider)
+
+            if hit is not None and (first is None or hit[0] < first[0]):
+                first = (hit[0], hit[1], object_)
+
+        return first
+
+    def objectsInBounds(self, bounds, mask = ALL_LAYERS):
+        """The objects on a layer in mask whose colliders' bounds overlap
+           bounds, given as (left, top, right, bottom). The bounds of
+           objects which aren't immobile are kept until any shape moves."""
+
+        self.updateStatic()
+
+        version = shapes.Shape.positionVersion
+
+        if self.dynamicBounds is None or self.dynamicBounds[0] != version:
+            self.dynamicBounds = (version,
+                                  colliderBounds(self.dynamicObjects)[0])
+
+        left, top, right, bottom = bounds
+        dynamic = self.dynamicBounds[1]
+
+        near = numpy.flatnonzero((dynamic[:, 0] < right) &
+                                 (left < dynamic[:, 2]) &
+                                 (dynamic[:, 1] < bottom) &
+                                 (top < dynamic[:, 3]))
+
+        objects = [self.dynamicObjects[i] for i in near.tolist()]
+
+        if self.staticTree is None:
+            objects.extend(object_ for object_ in self.staticObjects
+                           if quadtree.overlaps(
+                               quadtree.boundsOf(object_.collider), bounds))
+        else:
+            objects.extend(self.staticTree.queryBounds(bounds))
+
+        objects.sort(key = lambda object_ : object_.managerIndex)
+
+        return [object_ for object_ in objects
+                if object_.collisionLayer & mask]
+
+    def raycast(self, origin, direction, maxDistance, mask = ALL_LAYERS):
+        """Find the first object a ray from origin in direction meets
+           within maxDistance, as a QueryHit, or None if it meets
+           nothing. Objects the ray starts inside aren't met, so agents
+           may cast rays from their own centres."""
+
+        return self.raycastBatch([origin], [direction], maxDistance,
+                                 mask)[0]
+
+    def raycastBatch(self, origins, directions, maxDistance,
+                     mask = ALL_LAYERS):
+        """Cast many rays at once, as in raycast, returning a QueryHit or
+           None for each"""
+
+        origins = numpy.asarray(origins, numpy.float64).reshape(-1, 2)
+        directions = numpy.asarray(directions, numpy.float64).reshape(-1, 2)
+
+        if not len(origins):
+            return []
+
+        lengths = numpy.hypot(directions[:, 0], directions[:, 1])
+
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+            motions = directions * (maxDistance / lengths)[:, None]
+
+        motions[lengths == 0] = 0
+
+        ends = origins + motions
+        rayBounds = numpy.hstack((numpy.minimum(origins, ends),
+                                  numpy.maximum(origins, ends)))
+
+        objects = self.objectsInBounds(tuple(rayBounds[:, :2].min(0)) +
+                                       tuple(rayBounds[:, 2:].max(0)), mask)
+
+        found = [None] * len(origins)
+
+        if not objects:
+            return found
+
+        bounds, circles = colliderBounds(objects)
+        rays, columns = overlappingPairs(rayBounds, bounds)
+
+        #Each ray and object whose bounds overlap is one pair, and each
+        #pair is tested at once.
+
+        origin = origins[rays]
+        motion = motions[rays]
+        bounds = bounds[columns]
+        circle = circles[columns]
+
+        centres = (bounds[:, :2] + bounds[:, 2:]) / 2
+        radii = (bounds[:, 2] - bounds[:, 0]) / 2
+
+        circleTimes, circleNormals = rayCircles(origin, motion, centres,
+                                                radii)
+        times, normals = rayRects(origin, motion, bounds)
+
+        times = numpy.where(circle, circleTimes, times)
+        normals = numpy.where(circle[:, None], circleNormals, normals)
+
+        #The first hit of each ray, or of the first object among those
+        #hit at once.
+
+        hit = numpy.flatnonzero(times != numpy.inf)
+        hit = hit[numpy.lexsort((columns[hit], times[hit], rays[hit]))]
+
+        rows, first = numpy.unique(rays[hit], return_index = True)
+
+        for i, k in zip(rows.tolist(), hit[first].tolist()):
+            point = origin[k] + motion[k] * times[k]
+
+            found[i] = QueryHit(objects[columns[k]],
+                                float(times[k] * maxDistance),
+                                pygame.math.Vector2(point.tolist()),
+                                pygame.math.Vector2(normals[k].tolist()))
+
+        return found
+
+    def shapecast(self, collider, motion, mask = ALL_LAYERS):
+        """Find the first object a Circle or Rect would touch if moved by
+           motion, as a QueryHit whose point is the shape's position (as
+           given by getPos) when touching, or None if it would touch
+           nothing. Objects with the same collider are ignored."""
+
+        return self.shapecastBatch([collider], [motion], mask)[0]
+
+    def shapecastBatch(self, colliders, motions, mask = ALL_LAYERS):
+        """Cast many Circles and Rects at once, as in shapecast,
+           returning a QueryHit or None for each"""
+
+        colliders = list(colliders)
+        motions = numpy.asarray(motions, numpy.float64).reshape(-1, 2)
+
+        if not colliders:
+            return []
+
+        moving, movingCircles = colliderShapes(colliders)
+
+        #The area each shape passes through, grown by a pixel to take in
+        #rects which are rounded outwards.
+
+        starts = numpy.hstack((numpy.minimum(moving[:, :2] - moving[:, 2:4],
+                                             moving[:, 4:6]),
+                               numpy.maximum(moving[:, :2] + moving[:, 2:4],
+                                             moving[:, 6:])))
+        paths = numpy.hstack((numpy.minimum(starts[:, :2],
+                                            starts[:, :2] + motions) - 1,
+                              numpy.maximum(starts[:, 2:],
+                                            starts[:, 2:] + motions) + 1))
+
+        objects = self.objectsInBounds(tuple(paths[:, :2].min(0)) +
+                                       tuple(paths[:, 2:].max(0)), mask)
+
+        found = [None] * len(colliders)
+
+        if not objects:
+            return found
+
+        targets, targetCircles = colliderShapes([object_.collider
+                                                 for object_ in objects])
+        rows, columns = overlappingPairs(paths,
+                                         colliderBounds(objects)[0])
+
+        #Objects with the same collider as the shape are ignored.
+
+        ids = numpy.array([collider.id for collider in colliders])
+        targetIds = numpy.array([object_.collider.id for object_ in objects])
+
+        keep = ids[rows] != targetIds[columns]
+        rows = rows[keep]
+        columns = columns[keep]
+
+        #Each shape and object whose areas overlap is one pair, and each
+        #kind of pair is tested at once.
+
+        motion = motions[rows]
+        shape = moving[rows]
+        target = targets[columns]
+        circle = movingCircles[rows]
+        targetCircle = targetCircles[columns]
+
+        times = numpy.full(len(rows), numpy.inf)
+        normals = numpy.zeros((len(rows), 2))
+
+        pairs = circle & targetCircle
+
+        times[pairs], normals[pairs] = rayCircles(
+            shape[pairs, :2], motion[pairs], target[pairs, :2],
+            shape[pairs, 2] + target[pairs, 2])
+
+        pairs = circle & ~targetCircle
+
+        times[pairs], normals[pairs] = sweepCirclesRects(
+            shape[pairs, :2], motion[pairs], shape[pairs, 2],
+            target[pairs, 4:])
+
+        #A rect touches a circle when the circle moving the other way
+        #would touch it.
+
+        pairs = ~circle & targetCircle
+
+        times[pairs], normals[pairs] = sweepCirclesRects(
+            target[pairs, :2], -motion[pairs], target[pairs, 2],
+            shape[pairs, 4:])
+        normals[pairs] *= -1
+
+        #Against another rect, a rect's centre's path is tested against
+        #it grown by half the rect's size.
+
+        pairs = ~circle & ~targetCircle
+
+        times[pairs], normals[pairs] = rayRects(
+            shape[pairs, :2], motion[pairs],
+            numpy.hstack((target[pairs, 4:6] - shape[pairs, 2:4],
+                          target[pairs, 6:] + shape[pairs, 2:4])))
+
+        #The first hit of each shape, or of the first object among those
+        #hit at once.
+
+        hit = numpy.flatnonzero(times != numpy.inf)
+        hit = hit[numpy.lexsort((columns[hit], times[hit], rows[hit]))]
+
+        shapesHit, first = numpy.unique(rows[hit], return_index = True)
+        lengths = numpy.hypot(motions[:, 0], motions[:, 1])
+
+        Vector2 = pygame.math.Vector2
+
+        for i, k in zip(shapesHit.tolist(), hit[first].tolist()):
+            toi = float(times[k])
+
+            found[i] = QueryHit(objects[columns[k]], float(toi * lengths[i]),
+                                Vector2(colliders[i].getFloatPos()) +
+                                Vector2(motions[i].tolist()) * toi,
+                                Vector2(normals[k].tolist()))
+
+        return found
+
+    def queryRadius(self, point, radius, mask = ALL_LAYERS):
+        """Find the objects within radius of a point, nearest first, as
+           QueryHits. Each one's point is the nearest point of the
+           object to the point queried, and its normal points from there
+           to the point queried, or is zero if the point is inside it."""
+
+        return self.queryRadiusBatch([point], radius, mask)[0]
+
+    def queryRadiusBatch(self, points, radius, mask = ALL_LAYERS):
+        """Query around many points at once, as in queryRadius, returning
+           a list of QueryHits for each"""
+
+        points = numpy.asarray(points, numpy.float64).reshape(-1, 2)
+
+        if not len(points):
+            return []
+
+        areas = numpy.hstack((points - radius, points + radius))
+        objects = self.objectsInBounds(tuple(areas[:, :2].min(0)) +
+                                       tuple(areas[:, 2:].max(0)), mask)
+
+        found = [[] for point in points]
+
+        if not objects:
+            return found
+
+        bounds, circles = colliderBounds(objects)
+        rows, columns = overlappingPairs(areas, bounds)
+
+        point = points[rows]
+        bounds = bounds[columns]
+
+        #The nearest point of each object to each point near it.
+
+        centres = (bounds[:, :2] + bounds[:, 2:]) / 2
+        radii = (bounds[:, 2] - bounds[:, 0]) / 2
+
+        offsets = point - centres
+        lengths = numpy.hypot(offsets[:, 0], offsets[:, 1])
+
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+            onCircles = centres + offsets * (radii / lengths)[:, None]
+
+        inCircles = (lengths <= radii)[:, None]
+        inRects = numpy.clip(point, bounds[:, :2], bounds[:, 2:])
+
+        nearest = numpy.where(circles[columns, None],
+                              numpy.where(inCircles, point, onCircles),
+                              inRects)
+
+        offsets = point - nearest
+        distances = numpy.hypot(offsets[:, 0], offsets[:, 1])
+
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+            normals = offsets / distances[:, None]
+
+        normals[distances == 0] = 0
+
+        within = numpy.flatnonzero(distances <= radius)
+        within = within[numpy.lexsort((columns[within], distances[within],
+                                       rows[within]))]
+
+        Vector2 = pygame.math.Vector2
+
+        for i, j, distance, nearestPoint, normal in zip(
+            rows[within].tolist(), columns[within].tolist(),
+            distances[within].tolist(), nearest[within].tolist(),
+            normals[within].tolist()):
+
+            found[i].append(QueryHit(objects[j], distance,
+                                     Vector2(nearestPoint), Vector2(normal)))
+
+        return found
+
+    def queryRect(self, rect, mask = ALL_LAYERS):
+        """Find the objects whose colliders overlap a rect"""
+
+        return self.queryRectBatch([rect], mask)[0]
+
+    def queryRectBatch(self, rects, mask = ALL_LAYERS):
+        """Query many rects at once, as in queryRect, returning a list of
+           objects for each"""
+
+        rects = [pygame.Rect(rect) for rect in rects]
+
+        if not rects:
+            return []
+
+        areas = numpy.array([(rect.left, rect.top, rect.right, rect.bottom)
+                             for rect in rects], numpy.float64)
+
+        #Grown by a pixel to take in rects which are rounded outwards.
+
+        objects = self.objectsInBounds(tuple(areas[:, :2].min(0) - 1) +
+                                       tuple(areas[:, 2:].max(0) + 1), mask)
+
+        found = [[] for rect in rects]
+
+        if not objects:
+            return found
+
+        targets, circles = colliderShapes([object_.collider
+                                           for object_ in objects])
+        rows, columns = overlappingPairs(areas, targets[:, 4:])
+
+        area = areas[rows]
+        target = targets[columns]
+        circle = circles[columns]
+
+        #Rects overlap as pygame.Rect.colliderect has them, only if
+        #neither is empty, and circles as in shapes.CompactCircle.
+
+        overlapping = ((area[:, 0] < target[:, 6]) &
+                       (target[:, 4] < area[:, 2]) &
+                       (area[:, 1] < target[:, 7]) &
+                       (target[:, 5] < area[:, 3]) &
+                       (area[:, 0] < area[:, 2]) & (area[:, 1] < area[:, 3]) &
+                       (target[:, 4] < target[:, 6]) &
+                       (target[:, 5] < target[:, 7]))
+
+        closest = numpy.clip(target[:, :2], area[:, :2], area[:, 2:])
+        inCircles = (((target[:, :2] - closest) ** 2).sum(1) <
+                     target[:, 2] ** 2)
+
+        hits = numpy.where(circle, inCircles, overlapping)
+
+        for i, j in zip(rows[hits].tolist(), columns[hits].tolist()):
+            found[i].append(objects[j])
+
+        return found
+
     def moveWhileColliding(self, object_, hit, minSpeedSquared=4,
                            fidelity = 0.001):
         """Move an object if it is overlapping with another until it is
@@ -151,10 +1230,16 @@ class PhysicsManager(Thread):
         #be to where it collided, but also the slower this function will
         #run. This defults to the most recent delta time.
         
-        for collidingObject in hit[0] + hit[1]:
-            
-            angle_ = angle.angleBetween(collidingObject.collider.centre,
-                                        object_.collider.centre)
+        colliding = hit[0] + hit[1]
+
+        if not colliding:
+            return
+
+        angles = angle.angleBetweenArray([collidingObject.collider.centre
+                                          for collidingObject in colliding],
+                                         object_.collider.centre)
+        
+        for collidingObject, angle_ in zip(colliding, angles):
             
             while (object_.collider.collide(collidingObject.collider) 
                    and object_ != collidingObject):
@@ -162,24 +1247,125 @@ class PhysicsManager(Thread):
                 delta = angle_ * fidelity
                 object_.collider.move_ip(delta)
 
+    def snapshot(self, out = None):
+        """Pack the state of every object into one contiguous array of
+           shape (number of objects, SNAPSHOT_COLUMNS), to be restored
+           later. Pass a previous snapshot as out to reuse its memory."""
+
+        n = len(self.objects)
+
+        nan = (numpy.nan, numpy.nan)
+
+        rows = ((*object_.collider.getFloatPos(), *object_.velocity,
+                 *object_.acceleration, *object_.pos, object_.kinematic,
+                 object_.immobile, *object_.force,
+                 *(nan if object_.lastAcceleration is None else
+                   object_.lastAcceleration))
+                for object_ in self.objects)
+
+        if out is None:
+            return numpy.fromiter(chain.from_iterable(rows), numpy.float64,
+                                  n * SNAPSHOT_COLUMNS).reshape(
+                                      n, SNAPSHOT_COLUMNS)
+
+        if out.shape != (n, SNAPSHOT_COLUMNS):
+            raise ValueError("Snapshot is of a different set of objects")
+
+        for i, row in enumerate(rows): #Written straight into out, without
+            out[i] = row               #packing the whole state first.
+
+        return out
+
+    def restore(self, snapshot):
+        """Return every object to the state recorded in a snapshot. The
+           objects must be the same as when the snapshot was taken."""
+
+        if len(snapshot) != len(self.objects):
+            raise ValueError("Snapshot is of a different set of objects")
+
+        Vector2 = pygame.math.Vector2
+
+        for object_, (x, y, vx, vy, ax, ay, px, py, kinematic, immobile,
+                      fx, fy, lx, ly) in zip(self.objects, snapshot.tolist()):
+
+            object_.collider.setPos((x, y))
+            object_.velocity = Vector2(vx, vy)
+            object_.acceleration = Vector2(ax, ay)
+            object_.pos = Vector2(px, py)
+            object_.kinematic = bool(kinematic)
+            object_.immobile = bool(immobile)
+            object_.force = Vector2(fx, fy)
+            object_.lastAcceleration = (None if numpy.isnan(lx) else
+                                        Vector2(lx, ly))
+
+        self.invalidateBounds()
+
+    def publishFrame(self):
+        """Record the state of all objects and make it the latest frame
+           state available to other threads"""
+
+        frame = FrameState(self.frameCount, time.perf_counter(),
+                           MappingProxyType({
+                               id(object_) :
+                               tuple(object_.collider.getPos())
+                               for object_ in self.objects}),
+                           MappingProxyType({
+                               id(object_) : tuple(object_.velocity)
+                               for object_ in self.objects}))
+
+        self.frames[1] = frame #Fill the back buffer...
+
+        with self.frameLock:
+            self.frames.reverse() #...then swap it to the front.
+
+    def getFrame(self):
+        """Get the most recently published frame state"""
+
+        with self.frameLock:
+            return self.frames[0]
+
+    def acquireFrame(self):
+        """Take the latest frame state as the one to render from. Called
+           once per rendered frame, so that all objects are drawn from
+           the same physics frame."""
+
+        self.renderFrame = self.getFrame()
+        return self.renderFrame
+
     def run(self):
         
         #The run method is called when calling PhysicsManager.start()
         #if using a threaded approach.
-        
+
         while True:
-            self.update(self.dt)
+            #Ticking the clock sleeps for long enough to limit the
+            #update rate to tickRate, rather than spinning.
+
+            dt = self.clock.tick(self.tickRate) * self.timeScale / 1000
+            
+            self.update(dt)
+            self.publishFrame()
 
 class PhysicsObject():
     def __init__(self, pos, collider, kinematic = False,
                 density = 1, velocity = (0, 0), acceleration = (0, 0),
-                bounciness = 1, attractiveness = 0, immobile = False):
+                bounciness = 1, attractiveness = 0, immobile = False,
+                physicsManager = None, ccd = False, friction = 0,
+                collisionLayer = 1, collisionMask = ALL_LAYERS):
 
         self.pos = pygame.math.Vector2(pos) #Our initial position.
         self.velocity = pygame.math.Vector2(velocity) #Our initial
                                                       #velocity.
         self.acceleration = pygame.math.Vector2(acceleration)
-        #Our initial acceleration.
+        #Our acceleration, besides gravity and the forces applied to us.
+
+        self.force = pygame.math.Vector2() #The total force applied to us
+                                           #since the last update.
+
+        self.lastAcceleration = None
+        #Our acceleration last update, besides that from applied forces,
+        #by which the Verlet integrator moves us, or None until we've
+        #been updated.
         
         self.immobile = immobile #An immobile object is never expected
                                  #to move and thus only exists for
@@ -189,6 +1375,9 @@ class PhysicsObject():
                                      #the ratio of final relative speed
                                      #to initial relative speed after
                                      #collision.
+
+        self.friction = friction #The coefficient of friction, used by
+                                 #the impulse solver.
                                      
         self.attractiveness = attractiveness #How attractive an object 
                                              #is, used to simulate
@@ -198,6 +1387,17 @@ class PhysicsObject():
         self.kinematic = kinematic #A kinematic object does not respond
                                    #to forces. It will thus be
                                    #unaffected by gravity, for instance.
+
+        self.collisionLayer = collisionLayer #Bitfields of the layers we
+        self.collisionMask = collisionMask   #are on and the layers we
+                                             #collide with. Two objects
+                                             #collide only if each is on
+                                             #a layer in the other's
+                                             #mask.
+
+        self.ccd = ccd #Continuous collision detection sweeps a fast
+                       #moving circle along its path so that it cannot
+                       #pass through thin objects between frames.
         
         if isinstance(collider, shapes.Shape):
             self.collider = collider #A collider is an approximation of
@@ -207,10 +1407,11 @@ class PhysicsObject():
         else:
             raise ValueError("Collider must be a Shape")
             
-        self.physicsManager = PhysicsManager._instance
-        PhysicsManager._objects.append(self) #Add ourselves to the list
-                                             #of objects which the
-                                             #physics manager manages.
+        if physicsManager is None:
+            physicsManager = PhysicsManager._instance
+
+        physicsManager.add(self) #Add ourselves to the list of objects
+                                 #which the physics manager manages.
         
         self.density = density
         self.mass = self.density * self.collider.area #Mass = density *
@@ -220,39 +1421,126 @@ class PhysicsObject():
         
         self.weight = self.mass * self.physicsManager.g #F = ma
         
+    def destroy(self):
+        """Stop being simulated by our physics manager"""
+
+        self.physicsManager.remove(self)
+
+    def reset(self, pos = None, velocity = (0, 0), acceleration = (0, 0)):
+        """Return to a fresh state at pos, rejoining our physics manager
+           if we were destroyed, so that the object can be reused"""
+
+        if pos is not None:
+            self.collider.setPos(pos)
+            self.pos = pygame.math.Vector2(pos)
+
+        self.velocity = pygame.math.Vector2(velocity)
+        self.acceleration = pygame.math.Vector2(acceleration)
+        self.force = pygame.math.Vector2()
+        self.lastAcceleration = None
+
+        if self.managerIndex is None:
+            self.physicsManager.add(self)
+        elif self in self.physicsManager.removals:
+            #Destroyed during an update, so not yet removed. We're still
+            #simulated, so only the pending removal need be undone.
+            self.physicsManager.removals.remove(self)
+
     def applyAcceleration(self, a, dt):
         # v = u + at
         self.velocity[0] += a[0] * dt
         self.velocity[1] += a[1] * dt
         
     def applyForce(self, f):
-        # a = f / m
-        self.acceleration = f / self.mass
+        #Forces add up until the next update, where a = f / m.
+        self.force += f
+
+    def displacement(self, dt):
+        """How far we move in dt seconds"""
+
+        #The impulse solver has already given us half the acceleration by
+        #the time we move, so then we move by our velocity alone.
+
+        if (self.physicsManager.integrator == "verlet" and
+            self.physicsManager.solver is None and
+            self.lastAcceleration is not None):
+
+            # d = vt + at^2 / 2
+            return self.velocity * dt + self.lastAcceleration * (dt * dt / 2)
+
+        # d = vt
+        return self.velocity * dt
         
     def checkMove(self, dt):
         """Check whether we can move next frame, which we
         can unless we collided with something"""
+
+        if (self.ccd and isinstance(self.collider, shapes.CompactCircle) and
+            self.velocity.length() * dt >
+            self.physicsManager.ccdThreshold * self.collider.radius):
+
+            return self.sweptCheckMove(dt)
+
+        return self.discreteCheckMove(dt)
+
+    def discreteCheckMove(self, dt):
+        """Check for collision at the end of next frame's move along each
+           axis"""
         
         hit = []
         
         #Horizontal
         
-        testCol = self.collider.move(self.velocity[0] * dt, 0)
-        hit.append(self.physicsManager.collisionCheck(testCol))
+        displacement = self.displacement(dt)
+
+        testCol = self.collider.move(displacement[0], 0)
+        hit.append(self.physicsManager.collisionCheck(testCol, self))
         
         #Vertical
         
-        testCol = self.collider.move(0 , self.velocity[1] * dt)
-        hit.append(self.physicsManager.collisionCheck(testCol))
+        testCol = self.collider.move(0 , displacement[1])
+        hit.append(self.physicsManager.collisionCheck(testCol, self))
 
         return hit
     
+    def sweptCheckMove(self, dt, skin = 0.01):
+        """Check whether we can move next frame by sweeping our collider
+           along its path. If something is in the way we move up to it
+           along the axis we hit it on, leaving a small gap (the skin),
+           and report it as hit on that axis."""
+
+        motion = self.displacement(dt)
+
+        with self.physicsManager.profile("narrowphase"):
+            first = self.physicsManager.sweep(self.collider, motion, self)
+
+        if first is None:
+            return self.discreteCheckMove(dt)
+
+        toi, normal, object_ = first
+        axis = 0 if abs(normal[0]) >= abs(normal[1]) else 1
+        other = 1 - axis
+
+        delta = [0, 0]
+        delta[axis] = motion[axis] * toi + normal[axis] * skin
+        self.collider.move_ip(delta)
+
+        hit = [None, None]
+        hit[axis] = [object_]
+
+        delta = [0, 0]
+        delta[other] = motion[other]
+        hit[other] = self.physicsManager.collisionCheck(
+            self.collider.move(delta), self)
+
+        return hit
+
     def calcEnglish(self, hit):
         """Calcuate the angle on which we travel after colliding with
            a circle."""
         
         for object_ in hit:
-            if isinstance(object_.collider, shapes.Circle):
+            if isinstance(object_.collider, shapes.CompactCircle):
                 english = angle.angleBetween(object_.collider.centre,
                                              self.collider.centre)
                 return english
@@ -306,14 +1594,46 @@ class PhysicsObject():
         
         object_.applyAcceleration(angle_to * self.attractiveness /
                                   distance.length_squared(), dt)
+
+    def attractAll(self, objects, dt):
+        """Attract many objects at once"""
+
+        objects = [object_ for object_ in objects if object_ is not self]
+
+        if not objects:
+            return
+
+        centres = numpy.array([object_.collider.centre
+                               for object_ in objects], numpy.float64)
+
+        angles = angle.angleBetweenArray(centres, self.collider.centre)
+        distancesSquared = ((centres - self.collider.centre) ** 2).sum(-1)
+
+        #Objects at our centre have no direction to be pulled in.
+        strengths = numpy.divide(self.attractiveness, distancesSquared,
+                                 out = numpy.zeros_like(distancesSquared),
+                                 where = distancesSquared != 0)
+
+        for object_, a in zip(objects, angles * strengths[:, None]):
+            object_.applyAcceleration(a, dt)
                 
+    def renderPos(self):
+        """Our collider's position in the frame state being rendered,
+           for drawing while the physics runs in another thread. Falls
+           back to the collider's current position."""
+
+        frame = self.physicsManager.renderFrame
+
+        if frame is not None and id(self) in frame.positions:
+            return pygame.math.Vector2(frame.positions[id(self)])
+
+        return pygame.math.Vector2(self.collider.getPos())
+
     def physicsMoveX(self, dt):
-        # d = vt
-        self.collider.move_ip(self.velocity[0] * dt, 0)
+        self.collider.move_ip(self.displacement(dt)[0], 0)
     
     def physicsMoveY(self, dt):
-        # d = vt
-        self.collider.move_ip(0, self.velocity[1] * dt)
+        self.collider.move_ip(0, self.displacement(dt)[1])
         
     def onOwnCollision(self, hit):
         """Hook for user-defined function to be run when we register a
@@ -326,13 +1646,30 @@ class PhysicsObject():
            registers collision with this."""
         
         pass
+
+    def onCollisionBegin(self, other, axis):
+        """Hook run after the frame in which we start touching another
+           object"""
+
+        pass
+
+    def onCollisionStay(self, other, axis):
+        """Hook run after each further frame we keep touching another
+           object"""
+
+        pass
+
+    def onCollisionEnd(self, other, axis):
+        """Hook run after the frame in which we stop touching another
+           object"""
+
+        pass
         
     def kinematicUpdate(self, dt, hit):
         """Runs whether object is kinematic or not"""
         
         if self.attractiveness != 0:
-            for object_ in self.physicsManager.objects:
-                self.attract(object_, dt)
+            self.attractAll(self.physicsManager.objects, dt)
                                           
         if self.kinematic and not self.immobile:
             self.pos = self.collider.getPos() #Update position to
@@ -340,71 +1677,108 @@ class PhysicsObject():
                                               #collider.
                                               
             if any(hit):
-                self.onOwnCollision(hit)
-                
-                for object_ in hit[0]:
-                    object_.onOtherCollision(self, 0)
-                
-                for object_ in hit[1]:
-                    object_.onOtherCollision(self, 1)
+                self.physicsManager.reportCollision(self, hit)
             
+            profile = self.physicsManager.profile
+
             if not hit[0]: #If there was no collision in X.
-                self.physicsMoveX(dt)
+                with profile("integration"):
+                    self.physicsMoveX(dt)
             else:
-                self.push(hit[0], dt)
-                self.physicsManager.moveWhileColliding(self, hit)
+                with profile("resolution"):
+                    self.push(hit[0], dt)
+                    self.physicsManager.moveWhileColliding(self, hit)
                     
             if not hit[1]: #If there was no collision in Y.
-                self.physicsMoveY(dt)
+                with profile("integration"):
+                    self.physicsMoveY(dt)
             else:
-                self.push(hit[1], dt)
-                self.physicsManager.moveWhileColliding(self, hit)
+                with profile("resolution"):
+                    self.push(hit[1], dt)
+                    self.physicsManager.moveWhileColliding(self, hit)
                 
         
     def nonKinematicUpdate(self, dt, hit):
         """Runs only if object is not kinematic"""
         
         if any(hit):
-            self.onOwnCollision(hit)
-            
-            for object_ in hit[0]:
-                object_.onOtherCollision(self, 0)
-            
-            for object_ in hit[1]:
-                object_.onOtherCollision(self, 1)
+            self.physicsManager.reportCollision(self, hit)
+
+        profile = self.physicsManager.profile
         
         if not hit[0]: #If there was no collision in X.
-            self.physicsMoveX(dt)
+            with profile("integration"):
+                self.physicsMoveX(dt)
         else:
             #If we hit something bounce off of it and push it away.
             #This is only if the collision occured in our x axis.
+
+            with profile("resolution"):
+                self.push(hit[0], dt)
+                self.bounce(hit, 0, dt)
             
-            self.push(hit[0], dt)
-            self.bounce(hit, 0, dt)
-            
-            self.physicsManager.moveWhileColliding(self, hit)
+                self.physicsManager.moveWhileColliding(self, hit)
             
         if not hit[1]: #If there was no collision in Y.
-            self.physicsMoveY(dt)
+            with profile("integration"):
+                self.physicsMoveY(dt)
         else:
             #If we hit something bounce off of it and push it away.
             #This is only if the collision occured in our y axis.
+
+            with profile("resolution"):
+                self.push(hit[1], dt)
+                self.bounce(hit, 1, dt)
             
-            self.push(hit[1], dt)
-            self.bounce(hit, 1, dt)
-            
-            if any([isinstance(object_, shapes.Circle) for object_ in hit[1]]):
-                self.velocity.rotate_ip(round(angle.toDegrees(self.calcEnglish(hit[1])), 3))
+                if any([isinstance(object_, shapes.CompactCircle) for object_ in hit[1]]):
+                    self.velocity.rotate_ip(round(angle.toDegrees(self.calcEnglish(hit[1])), 3))
             
-            self.physicsManager.moveWhileColliding(self, hit)
-
-        self.applyAcceleration(self.physicsManager.g, dt)
-        self.applyAcceleration(self.acceleration, dt)
-        self.physicsManager.applyResistance(self, dt)
+                self.physicsManager.moveWhileColliding(self, hit)
         
     def physicsUpdate(self, dt):
+        if self.immobile:
+            hit = [[], []] #We never move, so need not check for it.
+        else:
+            hit = self.checkMove(dt)
+
         if not self.kinematic:
-            self.nonKinematicUpdate(dt, self.checkMove(dt))
-            
-        self.kinematicUpdate(dt, self.checkMove(dt))
-        
+            self.nonKinematicUpdate(dt, hit)
+
+            #kinematicUpdate only uses collisions for kinematic objects.
+            self.kinematicUpdate(dt, [[], []])
+        else:
+            self.kinematicUpdate(dt, hit)
+
+class ObjectPool():
+    """Keeps destroyed objects to be reset and reused, rather than new
+       ones being made, for games which spawn and destroy many objects.
+       factory makes a new object when none are free, and takes the
+       same arguments as PhysicsObject.reset."""
+
+    def __init__(self, factory, maxFree = None):
+        self.factory = factory
+        self.maxFree = maxFree #Most objects to keep. None for no limit.
+        self.free = []
+
+    def __len__(self):
+        return len(self.free)
+
+    def acquire(self, *args, **kwargs):
+        """Get a free object reset with the given arguments, or a new
+           one made with them"""
+
+        if not self.free:
+            return self.factory(*args, **kwargs)
+
+        object_ = self.free.pop()
+        object_.reset(*args, **kwargs)
+
+        return object_
+
+    def release(self, object_):
+        """Destroy an object, keeping it to be acquired again"""
+
+        object_.destroy()
+
+        if self.maxFree is None or len(self.free) < self.maxFree:
+            self.free.append(object_)
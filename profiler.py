@@ -0,0 +1,123 @@
+#profiler.py
+
+#This file contains a frame profiler for the game loop and physics. Code
+#is timed in named phases, and the total time spent in each phase per
+#frame is kept for a rolling window of frames, from which percentiles
+#are reported. Every timed phase is also kept as a trace event, which
+#can be saved as JSON and opened in Chrome's trace viewer
+#(chrome://tracing) for offline analysis.
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy
+
+class Profiler():
+    def __init__(self, window = 300, traceCapacity = 200000):
+        self.window = window #Number of frames to keep timings for.
+
+        self.samples = {} #Maps phase names to per frame totals.
+        self.frameTotals = {}
+        self.frameStart = None
+
+        self.lock = threading.Lock() #Physics running in its own thread
+                                     #records phases as frames end.
+
+        self.traceEvents = deque(maxlen = traceCapacity)
+        self.startTime = time.perf_counter()
+
+    def beginFrame(self):
+        with self.lock:
+            self.frameTotals = {}
+
+        self.frameStart = time.perf_counter()
+
+    def endFrame(self):
+        if self.frameStart is None:
+            return
+
+        self.record("frame", self.frameStart, time.perf_counter())
+
+        with self.lock:
+            frameTotals = self.frameTotals
+            self.frameTotals = {}
+
+        for name, total in frameTotals.items():
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen = self.window)
+
+            self.samples[name].append(total)
+
+        self.frameStart = None
+
+    def record(self, name, start, end):
+        """Record a phase that ran from start to end, as given by
+           time.perf_counter"""
+
+        with self.lock:
+            self.frameTotals[name] = (self.frameTotals.get(name, 0) +
+                                      end - start)
+
+        self.traceEvents.append((name, start, end, threading.get_ident()))
+
+    @contextmanager
+    def phase(self, name):
+        """Time the code run inside a with block as the named phase"""
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def percentiles(self, name, percentiles = (50, 95, 99)):
+        """Percentiles of a phase's time per frame, in seconds"""
+
+        if not self.samples.get(name):
+            return tuple(0 for p in percentiles)
+
+        return tuple(numpy.percentile(self.samples[name], percentiles))
+
+    def histogram(self, name, bins = 10):
+        """The counts and bin edges of a phase's time per frame"""
+
+        return numpy.histogram(self.samples.get(name, ()), bins)
+
+    def report(self):
+        """A table of each phase's p50, p95 and p99 times in ms"""
+
+        lines = ["{:<12}{:>8}{:>8}{:>8}".format("ms", "p50", "p95", "p99")]
+
+        for name in sorted(self.samples, key = lambda name : name != "frame"):
+            lines.append("{:<12}{:>8.2f}{:>8.2f}{:>8.2f}".format(
+                name, *[t * 1000 for t in self.percentiles(name)]))
+
+        return "\n".join(lines)
+
+    def renderOverlay(self, font, colour = (255, 255, 255), antialias = True):
+        """Render the report to a surface, for drawing over the game"""
+
+        import gui
+
+        return gui.multiLineRender(font, self.report(), antialias, colour)
+
+    def dumpChromeTrace(self, filename):
+        """Save recorded phases in the Chrome trace event format"""
+
+        pid = os.getpid()
+
+        events = [{"name" : name,
+                   "ph" : "X",
+                   "ts" : (start - self.startTime) * 1e6,
+                   "dur" : (end - start) * 1e6,
+                   "pid" : pid,
+                   "tid" : tid}
+                  for name, start, end, tid in self.traceEvents]
+
+        with open(filename, "w") as f:
+            json.dump({"traceEvents" : events, "displayTimeUnit" : "ms"}, f)
@@ -0,0 +1,329 @@
+#quadtree.py
+
+#This file contains a loose quadtree, a spatial index for finding the
+#shapes in an area without looking at every shape. The square bounds of
+#the tree are divided into four cells, each of those into four, and so
+#on down to a maximum depth. Each shape is kept in one cell: the
+#smallest whose size is at least the shape's, at the depth that gives,
+#and the one holding the shape's centre at that depth.
+
+#The tree is loose as each cell is taken to cover twice its own width,
+#reaching half a cell past each of its sides. A shape's cell therefore
+#always covers all of it, however it straddles cell borders, so shapes
+#never need splitting between cells or pushing up the tree. Cells are
+#kept in a dictionary per depth, keyed by their column and row, so that
+#empty cells take no memory and a shape's cell is found directly rather
+#than by walking down from the root.
+
+#The tree suits mostly static content such as level geometry and tiles,
+#for which it can be built in bulk. Shapes which move must be updated.
+
+import math
+
+import numpy
+import pygame
+
+import shapes
+
+def boundsOf(shape):
+    """The (left, top, right, bottom) of a Circle, Rect or anything with
+       those attributes"""
+
+    if isinstance(shape, shapes.CompactCircle):
+        x, y = shape.centre
+        r = shape.radius
+
+        return (x - r, y - r, x + r, y + r)
+
+    if isinstance(shape, shapes.CompactRect):
+        return (shape.float_x, shape.float_y,
+                shape.float_x + shape.width, shape.float_y + shape.height)
+
+    return (shape.left, shape.top, shape.right, shape.bottom)
+
+def boundsDistanceSquared(bounds, point):
+    """The squared distance from a point to the nearest point in some
+       bounds, which is zero if the point is inside them"""
+
+    dx = max(bounds[0] - point[0], 0, point[0] - bounds[2])
+    dy = max(bounds[1] - point[1], 0, point[1] - bounds[3])
+
+    return dx * dx + dy * dy
+
+def overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+class QuadTree():
+    def __init__(self, bounds, maxDepth = 8, getBounds = boundsOf):
+        """A tree covering bounds, given as (left, top, right, bottom).
+           Shapes outside them may still be added, but are kept apart
+           and looked at in every query. getBounds gives the bounds of
+           an item, so that objects other than shapes can be kept."""
+
+        self.left, self.top = bounds[0], bounds[1]
+        self.size = max(bounds[2] - bounds[0], bounds[3] - bounds[1])
+        self.maxDepth = maxDepth
+        self.getBounds = getBounds
+
+        self.levels = [{} for depth in range(maxDepth + 1)]
+        #Maps the (column, row) of each cell holding items to a
+        #dictionary of its items' ids to the items and their bounds.
+
+        self.outside = {} #Items not within the tree's bounds.
+        self.cells = {} #Maps items' ids to the cells they're kept in.
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, item):
+        return id(item) in self.cells
+
+    def __iter__(self):
+        for cell in self.iterCells():
+            for item, bounds in cell.values():
+                yield item
+
+    def iterCells(self):
+        for level in self.levels:
+            yield from level.values()
+
+        yield self.outside
+
+    def cellSize(self, depth):
+        return self.size / (1 << depth)
+
+    def locate(self, bounds):
+        """The depth and (column, row) of the cell to keep an item with
+           the given bounds in, or None if it is outside the tree"""
+
+        if (bounds[0] < self.left or bounds[1] < self.top or
+            bounds[2] > self.left + self.size or
+            bounds[3] > self.top + self.size):
+
+            return None
+
+        extent = max(bounds[2] - bounds[0], bounds[3] - bounds[1])
+
+        if extent > 0:
+            depth = min(int(math.log2(self.size / extent)), self.maxDepth)
+        else:
+            depth = self.maxDepth
+
+        size = self.cellSize(depth)
+        last = (1 << depth) - 1
+
+        column = int(((bounds[0] + bounds[2]) / 2 - self.left) // size)
+        row = int(((bounds[1] + bounds[3]) / 2 - self.top) // size)
+
+        return depth, (min(column, last), min(row, last))
+
+    def cellFor(self, location):
+        if location is None:
+            return self.outside
+
+        depth, key = location
+
+        return self.levels[depth].setdefault(key, {})
+
+    def insert(self, item):
+        bounds = tuple(self.getBounds(item))
+        location = self.locate(bounds)
+
+        self.cellFor(location)[id(item)] = (item, bounds)
+        self.cells[id(item)] = location
+
+    def remove(self, item):
+        location = self.cells.pop(id(item))
+        cell = self.cellFor(location)
+
+        del cell[id(item)]
+
+        if not cell and location is not None:
+            del self.levels[location[0]][location[1]]
+
+    def update(self, item):
+        """Move an item which has moved or changed size to its new cell"""
+
+        bounds = tuple(self.getBounds(item))
+        location = self.locate(bounds)
+
+        if location == self.cells[id(item)]:
+            self.cellFor(location)[id(item)] = (item, bounds)
+        else:
+            self.remove(item)
+            self.cellFor(location)[id(item)] = (item, bounds)
+            self.cells[id(item)] = location
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+
+        self.outside.clear()
+        self.cells.clear()
+
+    def build(self, items):
+        """Replace the tree's contents with items, finding all of their
+           cells at once"""
+
+        self.clear()
+
+        items = list(items)
+
+        if not items:
+            return
+
+        bounds = numpy.array([tuple(self.getBounds(item)) for item in items],
+                             numpy.float64).reshape(-1, 4)
+
+        inside = ((bounds[:, 0] >= self.left) & (bounds[:, 1] >= self.top) &
+                  (bounds[:, 2] <= self.left + self.size) &
+                  (bounds[:, 3] <= self.top + self.size))
+
+        extents = numpy.maximum(bounds[:, 2] - bounds[:, 0],
+                                bounds[:, 3] - bounds[:, 1])
+
+        with numpy.errstate(divide = "ignore"):
+            depths = numpy.floor(numpy.log2(self.size / extents))
+
+        depths = numpy.clip(numpy.nan_to_num(depths, posinf = self.maxDepth),
+                            0, self.maxDepth).astype(numpy.int64)
+
+        sizes = self.size / (1 << depths)
+        last = (1 << depths) - 1
+
+        columns = numpy.minimum(((bounds[:, 0] + bounds[:, 2]) / 2 -
+                                 self.left) // sizes, last).astype(numpy.int64)
+        rows = numpy.minimum(((bounds[:, 1] + bounds[:, 3]) / 2 -
+                              self.top) // sizes, last).astype(numpy.int64)
+
+        for item, itemBounds, isInside, depth, column, row in zip(
+            items, map(tuple, bounds.tolist()), inside.tolist(),
+            depths.tolist(), columns.tolist(), rows.tolist()):
+
+            location = (depth, (column, row)) if isInside else None
+
+            self.cellFor(location)[id(item)] = (item, itemBounds)
+            self.cells[id(item)] = location
+
+    def queryBounds(self, bounds):
+        """The items whose bounds overlap the given (left, top, right,
+           bottom)"""
+
+        found = []
+
+        for depth, level in enumerate(self.levels):
+            if not level:
+                continue
+
+            size = self.cellSize(depth)
+            last = (1 << depth) - 1
+
+            #Cells reach half their size past their sides.
+
+            firstColumn = max(int((bounds[0] - self.left) // size - 1), 0)
+            lastColumn = min(int((bounds[2] - self.left) // size + 1), last)
+            firstRow = max(int((bounds[1] - self.top) // size - 1), 0)
+            lastRow = min(int((bounds[3] - self.top) // size + 1), last)
+
+            numCells = ((lastColumn - firstColumn + 1) *
+                        (lastRow - firstRow + 1))
+
+            if numCells <= 0:
+                continue
+
+            if numCells < len(level):
+                cells = (level.get((column, row)) for column in
+                         range(firstColumn, lastColumn + 1)
+                         for row in range(firstRow, lastRow + 1))
+            else:
+                #Fewer cells are occupied than the query covers.
+                cells = (cell for (column, row), cell in level.items()
+                         if firstColumn <= column <= lastColumn and
+                         firstRow <= row <= lastRow)
+
+            for cell in cells:
+                if cell:
+                    found.extend(item for item, itemBounds in cell.values()
+                                 if overlaps(itemBounds, bounds))
+
+        found.extend(item for item, itemBounds in self.outside.values()
+                     if overlaps(itemBounds, bounds))
+
+        return found
+
+    def queryRect(self, rect):
+        """The items whose bounds overlap a rect"""
+
+        return self.queryBounds(boundsOf(pygame.Rect(rect)))
+
+    def queryShape(self, shape):
+        """The items whose bounds overlap a shape's bounds"""
+
+        return self.queryBounds(boundsOf(shape))
+
+    def queryPoint(self, point):
+        """The items whose bounds contain a point"""
+
+        return self.queryBounds((point[0], point[1], point[0], point[1]))
+
+    def nearest(self, point, k = 1, maxDistance = None):
+        """The k items nearest to a point, nearest first, measured to
+           the nearest point in their bounds. Only items within
+           maxDistance are found, if it is given."""
+
+        if not self.cells or k <= 0:
+            return []
+
+        #Search squares around the point, doubling in size until they
+        #hold k items within the radius searched. Every item within
+        #that radius lies within the square, so none can be missed.
+
+        radius = self.cellSize(self.maxDepth)
+        limit = math.hypot(max(abs(point[0] - self.left),
+                               abs(point[0] - self.left - self.size)),
+                           max(abs(point[1] - self.top),
+                               abs(point[1] - self.top - self.size)))
+        #Every item in the tree is within this of the point.
+
+        if maxDistance is not None:
+            limit = min(limit, maxDistance)
+
+        while True:
+            radius = min(radius, limit)
+            radiusSquared = radius * radius
+
+            candidates = self.queryBounds((point[0] - radius,
+                                           point[1] - radius,
+                                           point[0] + radius,
+                                           point[1] + radius))
+
+            withDistances = []
+
+            for item in candidates:
+                distanceSquared = boundsDistanceSquared(
+                    self.itemBounds(item), point)
+
+                if distanceSquared <= radiusSquared:
+                    withDistances.append((distanceSquared, id(item), item))
+
+            if len(withDistances) >= k or radius >= limit:
+                break
+
+            radius *= 2
+
+        if len(withDistances) < k and maxDistance is None:
+            #Items outside the tree may be further than any limit.
+
+            withDistances = [(boundsDistanceSquared(bounds, point),
+                              id(item), item)
+                             for cell in self.iterCells()
+                             for item, bounds in cell.values()]
+
+        withDistances.sort(key = lambda entry : entry[:2])
+
+        return [item for distanceSquared, i, item in withDistances[:k]]
+
+    def itemBounds(self, item):
+        """The bounds an item was last inserted or updated with"""
+
+        return self.cellFor(self.cells[id(item)])[id(item)][1]
@@ -0,0 +1,124 @@
+#replay.py
+
+#This file records the inputs to a game so that it can be replayed
+#exactly. A recording holds the seed given to the random module, then
+#for every frame the delta time simulated and the events handled. As
+#the engine's simulation depends only on these, feeding them back
+#reproduces the game bit for bit.
+
+#The format is a header of a 4 byte magic number, a format version and
+#the seed, followed by each frame as its delta time (a double) and event
+#count, then each event as its type, the length of its attributes and
+#the attributes themselves, marshalled.
+
+import marshal
+import os
+import random
+import struct
+
+import pygame
+
+MAGIC = b"PPER"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHQ")
+FRAME = struct.Struct("<dH")
+EVENT = struct.Struct("<IH")
+
+def _serialisable(value):
+    try:
+        marshal.dumps(value)
+        return True
+    except ValueError:
+        return False
+
+def _open(file, mode):
+    if isinstance(file, str):
+        return open(file, mode), True
+
+    return file, False
+
+class Recorder():
+    def __init__(self, file, seed = None):
+        """Start recording to a filename or binary file object. The
+           random module is seeded, with a random seed if none is
+           given, so that the recording can reproduce random numbers."""
+
+        if seed is None:
+            seed = struct.unpack("<Q", os.urandom(8))[0]
+
+        self.seed = seed
+        random.seed(self.seed)
+
+        self.file, self.ownsFile = _open(file, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.seed))
+
+        self.frameCount = 0
+
+    def recordFrame(self, deltaTime, events):
+        data = [FRAME.pack(deltaTime, len(events))]
+
+        for event in events:
+            attributes = {key : value for key, value in event.dict.items()
+                          if _serialisable(value)}
+            payload = marshal.dumps(attributes)
+
+            data.append(EVENT.pack(event.type, len(payload)))
+            data.append(payload)
+
+        self.file.write(b"".join(data))
+        self.frameCount += 1
+
+    def close(self):
+        if self.ownsFile:
+            self.file.close()
+        else:
+            self.file.flush()
+
+class Player():
+    def __init__(self, file):
+        """Start replaying a recording from a filename or binary file
+           object, seeding the random module as it was when recorded"""
+
+        self.file, self.ownsFile = _open(file, "rb")
+
+        magic, version, self.seed = HEADER.unpack(
+            self.file.read(HEADER.size))
+
+        if magic != MAGIC:
+            raise ValueError("Not a replay file")
+        if version != VERSION:
+            raise ValueError("Unsupported replay version")
+
+        random.seed(self.seed)
+
+        self.frameCount = 0
+        self.finished = False
+
+    def readFrame(self):
+        """Get the next frame's delta time and events, or None when the
+           recording has ended"""
+
+        data = self.file.read(FRAME.size)
+
+        if len(data) < FRAME.size:
+            self.finished = True
+            self.close()
+            return None
+
+        deltaTime, numEvents = FRAME.unpack(data)
+        events = []
+
+        for i in range(numEvents):
+            type_, length = EVENT.unpack(self.file.read(EVENT.size))
+            attributes = marshal.loads(self.file.read(length))
+
+            events.append(pygame.event.Event(type_, attributes))
+
+        self.frameCount += 1
+
+        return deltaTime, events
+
+    def close(self):
+        if self.ownsFile:
+            self.file.close()
@@ -6,25 +6,140 @@
 #collisions, and other functions such as a function to calculate the
 #area of the shape.
 
+#CompactCircle and CompactRect hold only the state they need in
+#__slots__, rather than a per-instance __dict__, for when there are a
+#great many of them. Circle and Rect are the same shapes with a __dict__,
+#so that other attributes can be set on them.
+
 import pygame
 import math
 from numpy import clip
 
+dirtyRectHandler = None #Function called with the area of a surface
+                        #changed when a shape is drawn, and the surface.
+                        #Set by game.Game when using dirty rect
+                        #rendering.
+
+drawnThisFrame = {} #Shapes reported drawn this frame and the last, by
+drawnLastFrame = {} #id, so that those no longer drawn can be erased.
+
+def reportDraw(shape, rect, colour):
+    """Report the previous and current area covered by a shape to the
+       dirty rect handler, if the shape has changed since last drawn"""
+
+    if dirtyRectHandler is None:
+        return
+
+    drawnThisFrame[id(shape)] = shape
+
+    drawn = (pygame.Rect(rect), colour)
+    lastDrawn = getattr(shape, "lastDrawn", None)
+
+    if drawn != lastDrawn:
+        if lastDrawn is not None:
+            dirtyRectHandler(lastDrawn[0], shape.surface)
+
+        dirtyRectHandler(drawn[0], shape.surface)
+        shape.lastDrawn = drawn
+
+def endFrame():
+    """Report the area last covered by each shape drawn last frame but
+       not this one, so that it is erased. Called by game.Game after
+       each frame is drawn."""
+
+    global drawnThisFrame, drawnLastFrame
+
+    for key, shape in drawnLastFrame.items():
+        if (key not in drawnThisFrame and
+            getattr(shape, "lastDrawn", None) is not None):
+
+            if dirtyRectHandler is not None:
+                dirtyRectHandler(shape.lastDrawn[0], shape.surface)
+
+            shape.lastDrawn = None
+
+    drawnLastFrame = drawnThisFrame
+    drawnThisFrame = {}
+
 def calcDist(a, b):
     """Calculate the distance between two points"""
     return math.sqrt((b[0] - a[0]) ** 2 +
                      (b[1] - a[1]) ** 2)
     
+def rayCircle(origin, direction, centre, radius):
+    """The fraction of direction travelled from origin when a ray first
+       meets a circle, or None if it doesn't within that distance. Rays
+       starting inside the circle don't count as meeting it."""
+
+    fx = origin[0] - centre[0]
+    fy = origin[1] - centre[1]
+
+    a = direction[0] ** 2 + direction[1] ** 2
+    b = 2 * (fx * direction[0] + fy * direction[1])
+    c = fx ** 2 + fy ** 2 - radius ** 2
+
+    if a == 0 or c <= 0:
+        return None
+
+    discriminant = b ** 2 - 4 * a * c
+
+    if discriminant < 0:
+        return None
+
+    t = (-b - math.sqrt(discriminant)) / (2 * a)
+
+    return t if 0 <= t <= 1 else None
+
+def rayRect(origin, direction, left, top, right, bottom):
+    """The fraction of direction travelled from origin when a ray first
+       enters a rectangle and the normal of the side it enters by, or
+       None if it doesn't within that distance. Rays starting inside the
+       rectangle don't count as entering it."""
+
+    tEnter = -math.inf
+    tExit = math.inf
+    normal = None
+
+    for axis, low, high in ((0, left, right), (1, top, bottom)):
+        if direction[axis] == 0:
+            if not low < origin[axis] < high:
+                return None
+            continue
+
+        t1 = (low - origin[axis]) / direction[axis]
+        t2 = (high - origin[axis]) / direction[axis]
+
+        if t1 > t2:
+            t1, t2 = t2, t1
+
+        if t1 > tEnter:
+            tEnter = t1
+            normal = [0, 0]
+            normal[axis] = -1 if direction[axis] > 0 else 1
+
+        tExit = min(tExit, t2)
+
+    if tEnter > tExit or not 0 <= tEnter <= 1:
+        return None
+
+    return tEnter, pygame.math.Vector2(normal)
+
 def toInts(iterable):
     """Convert all numbers in an iterable to integers"""
     return [int(i) for i in iterable]
 
 class Shape():
     """The class from which all shape classes inherit"""
+
+    __slots__ = ()
+
+    positionVersion = 0 #Incremented whenever any shape moves, so that
+                        #caches of where shapes are know when to rebuild.
+
     def collide(self, other):
-        if isinstance(other, Circle):
+        if isinstance(other, CompactCircle):
             return self.collidecircle(other)
-        elif isinstance(other, Rect):
+        elif isinstance(other, CompactRect):
             return self.colliderect(other)
         elif hasattr(other, "__iter__") and len(other) == 2:
             return self.collidepoint(other)
@@ -42,21 +157,47 @@ class Shape():
             return Circle(*self.args)
         elif isinstance(self, Rect):
             return Rect(*self.args)
+        elif isinstance(self, CompactCircle):
+            return CompactCircle(*self.args)
+        elif isinstance(self, CompactRect):
+            return CompactRect(*self.args)
     
     def getPos(self):
-        if isinstance(self, Circle):
+        if isinstance(self, CompactCircle):
             return self.centre
-        elif isinstance(self, Rect):
+        elif isinstance(self, CompactRect):
             return self.topleft
 
-class Circle(Shape):
+    def getFloatPos(self):
+        """Like getPos, but without rounding a Rect's position"""
+
+        if isinstance(self, CompactCircle):
+            return self.centre
+        elif isinstance(self, CompactRect):
+            return (self.float_x, self.float_y)
+
+    def setPos(self, pos):
+        """Move to a position, as returned by getPos"""
+
+        if isinstance(self, CompactCircle):
+            self.centre[0] = pos[0]
+            self.centre[1] = pos[1]
+
+            Shape.positionVersion += 1
+        elif isinstance(self, CompactRect):
+            self.float_x = float(pos[0])
+            self.float_y = float(pos[1])
+
+            self.move_ip(0, 0)
+
+class CompactCircle(Shape):
     """This class defines a Circle shape"""
+
+    __slots__ = ("centre", "radius", "surface", "colour", "id", "lastDrawn")
     
     def __init__(self, centre, radius, surface=None, colour=(0, 0, 0),
                  id_=None):
         
-        global idCount
-        
         Shape.__init__(self)
         
         if id_ is None:
@@ -64,13 +205,9 @@ class Circle(Shape):
         else:
             self.id = id_
         
-        self.args = [centre, radius, surface, colour, self.id]
-        
         self.centre = pygame.math.Vector2(centre)
         self.radius = radius
         
-        self.area = self.calcArea()
-        
         if surface is not None:
             self.surface = surface
         else:
@@ -78,10 +215,13 @@ class Circle(Shape):
             
         self.colour = colour
         
-    def draw(self, width = 0, colour = None):
-        pygame.draw.circle(self.surface, 
-                           colour if colour else self.colour,
-                           toInts(self.centre), self.radius, width)
+    def draw(self, width = 0, colour = None, pos = None):
+        colour = colour if colour else self.colour
+        centre = self.centre if pos is None else pos
+
+        reportDraw(self, pygame.draw.circle(self.surface, colour,
+                                            toInts(centre),
+                                            self.radius, width), colour)
     
     def move_ip(self, x, y = 0):
         
@@ -90,8 +230,18 @@ class Circle(Shape):
             
         self.centre[0] += x
         self.centre[1] += y
-        
-        self.args[0] = self.centre
+
+        Shape.positionVersion += 1
+
+    @property
+    def args(self):
+        """The arguments which would make a copy of us"""
+
+        return [self.centre, self.radius, self.surface, self.colour, self.id]
+
+    @property
+    def area(self):
+        return self.calcArea()
         
     def toRect(self, surface=None, colour=None):
         
@@ -104,6 +254,57 @@ class Circle(Shape):
         
     def calcArea(self):
         return math.pi * self.radius ** 2
+
+    def sweep(self, motion, other):
+        """Find when, moving by motion, we would first touch another
+           Circle or Rect. Returns the fraction of motion travelled
+           before touching and the surface normal there, or None if we
+           wouldn't touch it or are already overlapping it."""
+
+        if isinstance(other, CompactCircle):
+            t = rayCircle(self.centre, motion, other.centre,
+                          self.radius + other.radius)
+
+            if t is None:
+                return None
+
+            normal = self.centre + pygame.math.Vector2(motion) * t - other.centre
+
+            if normal.length_squared() > 0:
+                normal.normalize_ip()
+
+            return t, normal
+
+        #Against a rectangle, our centre's path is tested against the
+        #rectangle grown by our radius, which has rounded corners. This
+        #is the union of the rectangle grown in x, grown in y, and a
+        #circle at each corner.
+
+        r = self.radius
+        hits = [rayRect(self.centre, motion, other.left - r, other.top,
+                        other.right + r, other.bottom),
+                rayRect(self.centre, motion, other.left, other.top - r,
+                        other.right, other.bottom + r)]
+
+        for corner in (other.topleft, other.topright, other.bottomleft,
+                       other.bottomright):
+            t = rayCircle(self.centre, motion, corner, r)
+
+            if t is not None:
+                normal = (self.centre + pygame.math.Vector2(motion) * t -
+                          pygame.math.Vector2(corner))
+
+                if normal.length_squared() > 0:
+                    normal.normalize_ip()
+
+                hits.append((t, normal))
+
+        hits = [hit for hit in hits if hit is not None]
+
+        if not hits or self.collide(other):
+            return None
+
+        return min(hits, key = lambda hit : hit[0])
         
     def collidecircle(self, other):
         dx = other.centre[0] - self.centre[0]
@@ -135,10 +336,13 @@ class Circle(Shape):
         distanceSquared = (distanceX ** 2) + (distanceY ** 2)
         return distanceSquared < (self.radius ** 2)
 
-class Rect(Shape, pygame.Rect):
+class CompactRect(Shape, pygame.Rect):
     """This class defines a rectangle and inherits from pygame's
        built-in rectangle class while adding the needed functionality
        for physics"""
+
+    __slots__ = ("centre", "surface", "colour", "id", "float_x", "float_y",
+                 "lastDrawn")
     
     def __init__(self, pos, size, surface=None, colour=(0, 0, 0), 
                  id_=None):
@@ -146,18 +350,12 @@ class Rect(Shape, pygame.Rect):
         pygame.Rect.__init__(self, pos, size)
         Shape.__init__(self)
         
-        global idCount
-        
         if id_ is None:
             self.id = id(self)
         else:
             self.id = id_
-        
-        self.args = [pos, size, surface, colour, self.id]
             
         self.centre = pygame.math.Vector2(self.center)
-        
-        self.area = self.calcArea()
             
         if surface is not None:
             self.surface = surface
@@ -171,6 +369,17 @@ class Rect(Shape, pygame.Rect):
         
     def calcArea(self):
         return self.size[0] * self.size[1]
+
+    @property
+    def args(self):
+        """The arguments which would make a copy of us"""
+
+        return [self.topleft, self.size, self.surface, self.colour,
+                self.id]
+
+    @property
+    def area(self):
+        return self.calcArea()
     
     def toRect(self):
         return self
@@ -186,16 +395,45 @@ class Rect(Shape, pygame.Rect):
         self.x = self.float_x
         self.y = self.float_y
         
-        self.args[0] = (self.x, self.y)
         self.centre = pygame.math.Vector2(self.center)
+
+        Shape.positionVersion += 1
             
-    def draw(self, width = 0, colour = None):
-        pygame.draw.rect(self.surface, 
-                         colour if colour else self.colour,
-                         self, width)
+    def draw(self, width = 0, colour = None, pos = None):
+        colour = colour if colour else self.colour
+        rect = self if pos is None else pygame.Rect(toInts(pos), self.size)
+
+        reportDraw(self, pygame.draw.rect(self.surface, colour, rect,
+                                          width), colour)
         
     def collidecircle(self, circle):
         return circle.colliderect(self)
+
+    def sweep(self, motion, other):
+        """Like CompactCircle.sweep, but for a rectangle"""
+
+        if isinstance(other, CompactCircle):
+            #The circle moving the other way touches us at the same time.
+
+            hit = other.sweep(-pygame.math.Vector2(motion), self)
+
+            return None if hit is None else (hit[0], -hit[1])
+
+        #Against another rectangle, our centre's path is tested against
+        #it grown by half our size.
+
+        halfWidth = self.width / 2
+        halfHeight = self.height / 2
+
+        return rayRect((self.float_x + halfWidth, self.float_y + halfHeight),
+                       motion, other.left - halfWidth, other.top - halfHeight,
+                       other.right + halfWidth, other.bottom + halfHeight)
+
+class Circle(CompactCircle):
+    """A CompactCircle which can be given other attributes"""
+
+class Rect(CompactRect):
+    """A CompactRect which can be given other attributes"""
     
 class Polygon():
     def __init__(self, *points, surface=None, colour=(0, 0, 0)):
@@ -235,5 +473,7 @@ class Polygon():
         return abs((xTotal - yTotal) / 2)
         
     def draw(self, width = 0, colour = None):
-        pygame.draw.polygon(self.surface, colour if colour else self.colour,
-                            self.points, width)
+        colour = colour if colour else self.colour
+
+        reportDraw(self, pygame.draw.polygon(self.surface, colour,
+                                             self.points, width), colour)
@@ -0,0 +1,345 @@
+#solver.py
+
+#This file contains a sequential impulse contact solver, an alternative
+#to the push and bounce response of PhysicsObject which PhysicsManager
+#uses when created with solver="impulse".
+
+#Each frame, forces are applied to velocities, then every overlapping
+#pair of objects becomes a contact. The solver repeatedly visits each
+#contact, applying equal and opposite impulses along the contact normal
+#(for restitution) and tangent (for friction) until the velocities agree
+#with every contact at once. The total impulse of each contact is kept
+#and applied first the next frame, as contacts that persist between
+#frames usually need much the same impulse again. This "warm starting"
+#lets stacks and resting objects settle in a few iterations. Contacts
+#are kept in the physics manager's contact cache. Objects are
+#then moved by their velocities and pushed apart by any remaining
+#overlap.
+
+import math
+
+import pygame
+
+import shapes
+
+class Contact():
+    __slots__ = ("a", "b", "normal", "penetration", "tangent",
+                 "normalImpulse", "tangentImpulse", "bounds")
+
+    def __init__(self, a, b, normal, penetration, bounds = None):
+        self.a = a
+        self.b = b
+        self.normal = normal #Unit vector pointing from a to b.
+        self.penetration = penetration
+        self.bounds = bounds #The colliders' bounds it was found from.
+
+        self.tangent = pygame.math.Vector2(-normal[1], normal[0])
+
+        self.normalImpulse = 0 #Total impulses applied, kept between
+        self.tangentImpulse = 0 #frames for warm starting.
+
+
+def getBounds(collider):
+    """A collider's centre and half size, unrounded"""
+
+    if isinstance(collider, shapes.CompactCircle):
+        return (collider.centre[0], collider.centre[1],
+                collider.radius, collider.radius)
+
+    halfWidth = collider.width / 2
+    halfHeight = collider.height / 2
+
+    return (collider.float_x + halfWidth, collider.float_y + halfHeight,
+            halfWidth, halfHeight)
+
+def findContact(a, b, bounds = None):
+    """The contact normal from collider a to collider b and the depth
+       they overlap by, or None if they don't overlap. The colliders'
+       bounds may be given if they're already known."""
+
+    if bounds is None:
+        bounds = getBounds(a), getBounds(b)
+
+    (ax, ay, aw, ah), (bx, by, bw, bh) = bounds
+
+    dx = bx - ax
+    dy = by - ay
+
+    aCircle = isinstance(a, shapes.CompactCircle)
+    bCircle = isinstance(b, shapes.CompactCircle)
+
+    if aCircle and bCircle:
+        distance = math.hypot(dx, dy)
+        penetration = aw + bw - distance
+
+        if penetration <= 0:
+            return None
+        if distance == 0:
+            return pygame.math.Vector2(1, 0), penetration
+
+        return pygame.math.Vector2(dx / distance, dy / distance), penetration
+
+    if aCircle or bCircle:
+        if bCircle:
+            #Find the contact from the rect to the circle and reverse it.
+            found = findContact(b, a, bounds[::-1])
+            return None if found is None else (-found[0], found[1])
+
+        #a is a circle, b a rect. Find the closest point in the rect to
+        #the circle's centre.
+
+        closestX = min(max(-dx, -bw), bw)
+        closestY = min(max(-dy, -bh), bh)
+
+        if abs(dx) < bw and abs(dy) < bh:
+            #The centre is inside the rect, so push out of the nearest
+            #side.
+
+            if bw - abs(dx) < bh - abs(dy):
+                normal = pygame.math.Vector2(1 if dx > 0 else -1, 0)
+                return normal, aw + bw - abs(dx)
+
+            normal = pygame.math.Vector2(0, 1 if dy > 0 else -1)
+            return normal, aw + bh - abs(dy)
+
+        offsetX = closestX + dx #From the circle's centre to the closest
+        offsetY = closestY + dy #point.
+        distance = math.hypot(offsetX, offsetY)
+
+        if distance >= aw:
+            return None
+
+        return (pygame.math.Vector2(offsetX / distance, offsetY / distance),
+                aw - distance)
+
+    overlapX = aw + bw - abs(dx)
+    overlapY = ah + bh - abs(dy)
+
+    if overlapX <= 0 or overlapY <= 0:
+        return None
+
+    if overlapX < overlapY:
+        return pygame.math.Vector2(1 if dx > 0 else -1, 0), overlapX
+
+    return pygame.math.Vector2(0, 1 if dy > 0 else -1), overlapY
+
+def inverseMass(object_):
+    if object_.immobile or object_.kinematic:
+        return 0
+
+    return 1 / object_.mass
+
+class ImpulseSolver():
+    def __init__(self, physicsManager, iterations = 8,
+                 restitutionThreshold = None, correction = 0.8,
+                 slop = 0.5):
+
+        self.physicsManager = physicsManager
+        self.iterations = iterations #Passes over the contacts per frame.
+
+        if restitutionThreshold is None:
+            restitutionThreshold = physicsManager.pixelsPerMetre
+
+        self.restitutionThreshold = restitutionThreshold
+        #Contacts closing slower than this don't bounce, so that resting
+        #objects come to rest rather than bouncing forever.
+
+        self.correction = correction #Fraction of overlap corrected.
+        self.slop = slop #Overlap allowed, to keep contacts alive.
+
+    def findContacts(self):
+        """Every overlapping pair of objects. A pair in contact last
+           frame whose colliders haven't moved since keeps last frame's
+           contact, rather than finding it again."""
+
+        manager = self.physicsManager
+        order = {id(object_) : i for i, object_ in enumerate(manager.objects)}
+
+        contacts = []
+
+        for a in manager.objects:
+            for b in manager.broadphase(a.collider, a):
+                if order[id(b)] < order[id(a)]:
+                    continue #Each pair only once.
+
+                bounds = getBounds(a.collider), getBounds(b.collider)
+                previous = manager.contactCache.previous(a, b)
+
+                if previous is not None and previous[3] is not None:
+                    previous = previous[3]
+
+                    if previous.a is a and previous.bounds == bounds:
+                        contacts.append(previous)
+                        continue
+
+                found = findContact(a.collider, b.collider, bounds)
+
+                if found is not None:
+                    contacts.append(Contact(a, b, *found, bounds))
+
+        return contacts
+
+    def integrateForces(self, dt):
+        manager = self.physicsManager
+
+        for object_ in manager.objects:
+            if object_.attractiveness != 0:
+                object_.attractAll([other for other in manager.objects
+                                    if not (other.kinematic or
+                                            other.immobile)], dt)
+
+        manager.integrateForces(manager.objects, dt)
+
+    def warmStart(self, contacts):
+        for contact in contacts:
+            previous = self.physicsManager.contactCache.previous(contact.a,
+                                                                 contact.b)
+
+            if previous is None or previous[3] is None:
+                continue
+
+            previous = previous[3]
+
+            contact.normalImpulse = previous.normalImpulse
+            contact.tangentImpulse = previous.tangentImpulse
+
+            self.applyImpulse(contact, contact.normal * contact.normalImpulse +
+                              contact.tangent * contact.tangentImpulse)
+
+    def applyImpulse(self, contact, impulse):
+        contact.a.velocity -= impulse * inverseMass(contact.a)
+        contact.b.velocity += impulse * inverseMass(contact.b)
+
+    def solveContact(self, contact, restitution, friction, targetSpeed):
+        invMassA = inverseMass(contact.a)
+        invMassB = inverseMass(contact.b)
+        invMassTotal = invMassA + invMassB
+
+        relative = contact.b.velocity - contact.a.velocity
+
+        #Normal impulse, clamped so the total never pulls objects
+        #together.
+
+        normalSpeed = relative.dot(contact.normal)
+        impulse = (targetSpeed - normalSpeed) / invMassTotal
+
+        total = max(contact.normalImpulse + impulse, 0)
+        impulse = total - contact.normalImpulse
+        contact.normalImpulse = total
+
+        self.applyImpulse(contact, contact.normal * impulse)
+
+        #Friction impulse, clamped by the normal impulse.
+
+        relative = contact.b.velocity - contact.a.velocity
+        impulse = -relative.dot(contact.tangent) / invMassTotal
+
+        limit = friction * contact.normalImpulse
+        total = min(max(contact.tangentImpulse + impulse, -limit), limit)
+        impulse = total - contact.tangentImpulse
+        contact.tangentImpulse = total
+
+        self.applyImpulse(contact, contact.tangent * impulse)
+
+    def correctPositions(self, contacts):
+        for contact in contacts:
+            invMassA = inverseMass(contact.a)
+            invMassB = inverseMass(contact.b)
+
+            if invMassA + invMassB == 0:
+                #Neither responds to forces, as with a kinematic paddle
+                #and a wall, but those which aren't immobile are still
+                #kept out, as in the legacy response.
+
+                invMassA = 0 if contact.a.immobile else 1
+                invMassB = 0 if contact.b.immobile else 1
+
+                if invMassA + invMassB == 0:
+                    continue
+
+            depth = max(contact.penetration - self.slop, 0)
+            correction = (contact.normal * depth * self.correction /
+                          (invMassA + invMassB))
+
+            for object_, share in ((contact.a, -invMassA),
+                                   (contact.b, invMassB)):
+                if share:
+                    object_.collider.move_ip(correction * share)
+
+                    if object_.kinematic:
+                        object_.pos = object_.collider.getPos()
+
+    def notify(self, contacts):
+        """Report the contacts to the physics manager, putting each on
+           the axis its normal is closest to"""
+
+        manager = self.physicsManager
+        hits = {}
+
+        for contact in contacts:
+            axis = 0 if abs(contact.normal[0]) >= abs(contact.normal[1]) else 1
+
+            manager.contactCache.add(contact.a, contact.b, axis, contact)
+
+            for object_, other in ((contact.a, contact.b),
+                                   (contact.b, contact.a)):
+                hits.setdefault(id(object_), (object_, [[], []]))
+                hits[id(object_)][1][axis].append(other)
+
+        for object_, hit in hits.values():
+            manager.reportCollision(object_, hit)
+
+    def step(self, dt):
+        manager = self.physicsManager
+
+        with manager.profile("integration"):
+            self.integrateForces(dt)
+
+        contacts = self.findContacts()
+
+        with manager.profile("resolution"):
+            #How fast each contact should separate is found before warm
+            #starting changes the velocities, so that contacts which
+            #persist still bounce.
+
+            pairs = []
+
+            for contact in contacts:
+                if inverseMass(contact.a) + inverseMass(contact.b) == 0:
+                    continue #Neither can respond to impulses.
+
+                closingSpeed = -(contact.b.velocity -
+                                 contact.a.velocity).dot(contact.normal)
+
+                restitution = (contact.a.bounciness +
+                               contact.b.bounciness) / 2
+                friction = math.sqrt(contact.a.friction * contact.b.friction)
+
+                if closingSpeed > self.restitutionThreshold:
+                    targetSpeed = restitution * closingSpeed
+                else:
+                    targetSpeed = 0
+
+                pairs.append((contact, restitution, friction, targetSpeed))
+
+            self.warmStart([pair[0] for pair in pairs])
+
+            for i in range(self.iterations):
+                for pair in pairs:
+                    self.solveContact(*pair)
+
+        with manager.profile("integration"):
+            for object_ in manager.objects:
+                if not object_.immobile:
+                    object_.collider.move_ip(object_.displacement(dt))
+
+                    if object_.kinematic:
+                        object_.pos = object_.collider.getPos()
+
+            if manager.integrator == "verlet":
+                manager.finishVerletStep(manager.objects, dt)
+
+        with manager.profile("resolution"):
+            self.correctPositions(contacts)
+
+        self.notify(contacts)
@@ -1,8 +1,254 @@
 import pygame
+import json
+import os
+from collections import OrderedDict
 
 COLOURKEY = (255, 0, 255)
 
-def split(atlas, tileSize, colourKey = COLOURKEY, gapSize = 1, scaleTo = None):
+class LRUCache():
+    """A dictionary holding at most maxSize items, discarding the least
+       recently used item when full"""
+
+    def __init__(self, maxSize = 256):
+        self.maxSize = maxSize
+        self.items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default = None):
+        if key not in self.items:
+            return default
+
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+
+        while len(self.items) > self.maxSize:
+            self.items.popitem(last = False)
+
+    def clear(self):
+        self.items.clear()
+
+def convertToDisplay(img):
+    """Convert to the display's pixel format if there is a display"""
+
+    if pygame.display.get_surface() is None:
+        return img
+
+    if img.get_flags() & pygame.SRCALPHA:
+        return img.convert_alpha()
+
+    return img.convert()
+
+class PackedAtlas():
+    """Many images packed into a single surface, looked up by id"""
+
+    def __init__(self, surface, rects, colourKey = COLOURKEY, cacheSize = 256):
+        self.surface = surface
+        self.rects = rects #Maps sprite id to its pygame.Rect in surface.
+        self.colourKey = colourKey
+
+        self.sprites = {}
+        self.scaledCache = LRUCache(cacheSize)
+
+    def __contains__(self, spriteId):
+        return spriteId in self.rects
+
+    def __getitem__(self, spriteId):
+        if spriteId not in self.sprites:
+            img = self.surface.subsurface(self.rects[spriteId])
+
+            if self.colourKey is not None:
+                img.set_colorkey(self.colourKey)
+
+            self.sprites[spriteId] = img
+
+        return self.sprites[spriteId]
+
+    def getScaled(self, spriteId, size):
+        """Get a sprite scaled to size, scaling it only the first time
+           it is asked for until it is evicted from the cache"""
+
+        key = (spriteId, tuple(size))
+        img = self.scaledCache.get(key)
+
+        if img is None:
+            img = convertToDisplay(pygame.transform.scale(self[spriteId], key[1]))
+
+            if self.colourKey is not None:
+                img.set_colorkey(self.colourKey)
+
+            self.scaledCache.put(key, img)
+
+        return img
+
+    def save(self, filename):
+        """Save the packed surface as an image, and its lookup table as
+           JSON alongside it"""
+
+        pygame.image.save(self.surface, filename)
+
+        with open(filename + ".json", "w") as f:
+            json.dump({"colourKey" : self.colourKey,
+                       "rects" : [[spriteId, list(rect)] for spriteId, rect
+                                  in self.rects.items()]}, f)
+
+    def load(filename, cacheSize = 256):
+        with open(filename + ".json") as f:
+            data = json.load(f)
+
+        rects = {tuple(spriteId) if isinstance(spriteId, list) else spriteId :
+                 pygame.Rect(rect) for spriteId, rect in data["rects"]}
+        colourKey = (tuple(data["colourKey"])
+                     if data["colourKey"] is not None else None)
+
+        return PackedAtlas(convertToDisplay(pygame.image.load(filename)), rects,
+                           colourKey, cacheSize)
+
+def pack(images, padding = 1, maxWidth = 2048, colourKey = COLOURKEY,
+         cacheSize = 256):
+    """Pack images, a dictionary of id to surface or a list of surfaces,
+       into one surface using shelf packing. Images are placed tallest
+       first along rows no wider than maxWidth."""
+
+    if not isinstance(images, dict):
+        images = dict(enumerate(images))
+
+    order = sorted(images, key = lambda spriteId : images[spriteId].get_height(),
+                   reverse = True)
+
+    rects = {}
+    x = y = width = shelfHeight = 0
+
+    for spriteId in order:
+        w, h = images[spriteId].get_size()
+
+        if x > 0 and x + w > maxWidth:
+            x = 0
+            y += shelfHeight + padding
+            shelfHeight = 0
+
+        rects[spriteId] = pygame.Rect(x, y, w, h)
+
+        x += w + padding
+        width = max(width, x - padding)
+        shelfHeight = max(shelfHeight, h)
+
+    height = y + shelfHeight
+
+    if any(img.get_flags() & pygame.SRCALPHA for img in images.values()):
+        surface = pygame.Surface((max(width, 1), max(height, 1)),
+                                 pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 0))
+    else:
+        surface = pygame.Surface((max(width, 1), max(height, 1)))
+        surface.fill(colourKey if colourKey is not None else (0, 0, 0))
+
+    for spriteId, rect in rects.items():
+        surface.blit(images[spriteId], rect)
+
+    return PackedAtlas(surface, rects, colourKey, cacheSize)
+
+def packCached(filename, loadImages, *args, **kwargs):
+    """Load a packed atlas from filename if it has been saved before,
+       otherwise call loadImages to get the images, pack and save them.
+       Delete the files to force the atlas to be rebuilt."""
+
+    if os.path.exists(filename) and os.path.exists(filename + ".json"):
+        return PackedAtlas.load(filename, kwargs.get("cacheSize", 256))
+
+    atlas = pack(loadImages(), *args, **kwargs)
+    atlas.save(filename)
+
+    return atlas
+
+class LazyAtlas():
+    """A sprite sheet split into a grid of sprites, where each sprite is
+       only cut out, colour keyed and scaled when first accessed. Use
+       as atlas[i][j] or atlas[i, j], as with the lists made by split."""
+
+    def __init__(self, atlas, tileSize, colourKey = COLOURKEY, gapSize = 1,
+                 scaleTo = None, cacheSize = 256):
+
+        self.atlas = atlas
+        self.tileSize = tileSize
+        self.colourKey = colourKey
+        self.gapSize = gapSize
+        self.scaleTo = scaleTo
+
+        self.columns = len(range(0, atlas.get_width(), tileSize[0] + gapSize))
+        self.rows = len(range(0, atlas.get_height(), tileSize[1] + gapSize))
+
+        self.cache = LRUCache(cacheSize)
+
+    def __len__(self):
+        return self.columns
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            return self.getSprite(*index)
+
+        if not -self.columns <= index < self.columns:
+            raise IndexError("Atlas column out of range")
+
+        return _AtlasColumn(self, index % self.columns)
+
+    def getRect(self, i, j):
+        return pygame.Rect(i * (self.tileSize[0] + self.gapSize),
+                           j * (self.tileSize[1] + self.gapSize),
+                           self.tileSize[0], self.tileSize[1])
+
+    def getSprite(self, i, j):
+        if not (-self.columns <= i < self.columns and
+                -self.rows <= j < self.rows):
+
+            raise IndexError("Atlas index out of range")
+
+        i %= self.columns #Negative indices count from the end, as with
+        j %= self.rows    #lists.
+
+        img = self.cache.get((i, j))
+
+        if img is None:
+            img = self.atlas.subsurface(self.getRect(i, j))
+
+            if self.scaleTo is not None:
+                img = pygame.transform.scale(img, self.scaleTo).convert()
+
+            img.set_colorkey(self.colourKey)
+
+            self.cache.put((i, j), img)
+
+        return img
+
+class _AtlasColumn():
+    def __init__(self, atlas, i):
+        self.atlas = atlas
+        self.i = i
+
+    def __len__(self):
+        return self.atlas.rows
+
+    def __getitem__(self, j):
+        if not -self.atlas.rows <= j < self.atlas.rows:
+            raise IndexError("Atlas row out of range")
+
+        return self.atlas.getSprite(self.i, j % self.atlas.rows)
+
+def split(atlas, tileSize, colourKey = COLOURKEY, gapSize = 1, scaleTo = None,
+          lazy = False, cacheSize = 256):
+
+    if lazy:
+        return LazyAtlas(atlas, tileSize, colourKey, gapSize, scaleTo,
+                         cacheSize)
+
     sprites = []
     
     for i in range(0, atlas.get_width(), tileSize[0] + gapSize):